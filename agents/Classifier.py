@@ -1,4 +1,4 @@
-from transformers import pipeline
+from models import get_model, ZERO_SHOT
 import re
 
 
@@ -6,12 +6,7 @@ class ClassifierAgent:
 
     def __init__(self):
 
-        print("Loading zero-shot model...")
-
-        self.classifier = pipeline(
-            "zero-shot-classification",
-            model="knowledgator/comprehend_it-base"
-        )
+        # the zero-shot pipeline is loaded by the model registry on first use
 
         self.categories = [
             "Career / Jobs",
@@ -64,6 +59,12 @@ class ClassifierAgent:
         print("Classifier ready.")
 
 
+    @property
+    def classifier(self):
+
+        return get_model(ZERO_SHOT)
+
+
     def rule_based_classify(self, text):
 
         text = text.lower()
@@ -1,8 +1,8 @@
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import util
+from models import get_model, MINILM
 
 class ClassifierAgent:
     def __init__(self):
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
         
         # Refined categories with descriptions
         self.categories = {
@@ -21,11 +21,21 @@ class ClassifierAgent:
             "Others": "Emails that don't match any of the above clearly"
         }
 
-        # Pre-compute category embeddings
-        self.category_embeddings = {
-            name: self.model.encode(desc, convert_to_tensor=True)
-            for name, desc in self.categories.items()
-        }
+        # Category embeddings are computed on first use
+        self._category_embeddings = None
+
+    @property
+    def model(self):
+        return get_model(MINILM)
+
+    @property
+    def category_embeddings(self):
+        if self._category_embeddings is None:
+            self._category_embeddings = {
+                name: self.model.encode(desc, convert_to_tensor=True)
+                for name, desc in self.categories.items()
+            }
+        return self._category_embeddings
 
     def classify_subject(self, subject: str) -> str:
         print("The classifier_agent.py is running")
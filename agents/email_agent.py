@@ -1,6 +1,15 @@
 from server.getting_mail import EmailFetchAgent
+from server.imap_session import ImapSession, ImapIdleWatcher
 from server.send_emails import EmailSendAgent
+from db import enqueue_outbox, claim_outbox, next_outbox_due, finish_outbox, requeue_interrupted_outbox
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import itertools
 import os
+import smtplib
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,21 +17,96 @@ load_dotenv()
 EMAIL = os.environ["EMAIL_ADDRESS"]
 PASSWORD = os.environ["EMAIL_PASSWORD"]
 
+# Upper bound on one IMAP/SMTP call as seen by a tool; the socket timeouts catch stalls below this
+EMAIL_IO_TIMEOUT = float(os.getenv("EMAIL_IO_TIMEOUT", "300"))
+SMTP_WORKERS = int(os.getenv("SMTP_WORKERS", "2"))
+
+# Outbox delivery: retries back off from OUTBOX_RETRY_BASE seconds, doubling up to OUTBOX_RETRY_MAX
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_BASE = 30
+OUTBOX_RETRY_MAX = 30 * 60
+OUTBOX_POLL = 30
+# The server rejected the message itself, so sending it again won't help
+PERMANENT_SMTP_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
 class EmailAgent:
     def __init__(self):
         self.name = "email_agent"
         self.agent = EmailFetchAgent(email_address=EMAIL, app_password=PASSWORD)
-        self.send_agent = EmailSendAgent(EMAIL, PASSWORD)
+        # One logged-in connection reused by every call instead of connect/disconnect per request
+        self.session = ImapSession(self.agent)
+        # One pooled SMTP connection per sending thread
+        self.send_agent = EmailSendAgent(EMAIL, PASSWORD, pool_size=SMTP_WORKERS)
+        self.watchers = {}
+        # imaplib and smtplib block, so they run here instead of on the event loop.
+        # The IMAP session is a single connection, hence a single worker.
+        self.imap_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="imap")
+        self.smtp_executor = ThreadPoolExecutor(max_workers=SMTP_WORKERS, thread_name_prefix="smtp")
+        self.outbox_workers = []
+        self.outbox_wakeup = None
+
+    async def _run_imap(self, fn, *args, folder: str = None, timeout: float = EMAIL_IO_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+        call = functools.partial(self.session.run, fn, *args, folder=folder, cancelled=cancelled)
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self.imap_executor, call), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # The worker thread can't be cancelled, so cut its connection to make it return,
+            # or drop the call if it is still queued behind another one
+            self.session.abort(cancelled)
+            raise
+
+    async def _run_smtp(self, fn, *args, timeout: float = EMAIL_IO_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(self.smtp_executor, functools.partial(fn, *args)), timeout)
 
     async def fetch_latest_emails(self):
         """Fetch the latest emails from the inbox"""
-        self.agent.connect()
-        try:
-            print("The email_agent.py is working")
-            emails = self.agent.fetch_latest_emails()
-            return {"emails": emails}
-        finally:
-            self.agent.disconnect()
+        print("The email_agent.py is working")
+        emails = await self._run_imap(self.agent.fetch_latest_emails)
+        return {"emails": emails}
+
+    async def sync_emails(self, last_uid: int = 0, uidvalidity=None, folder: str = "inbox"):
+        """Fetch only the mail that arrived after the given UID watermark"""
+        return await self._run_imap(self.agent.fetch_new_emails, last_uid, uidvalidity, folder=folder)
+
+    async def list_emails(self, count: int = 20):
+        """Headers of the latest emails, without their bodies"""
+        return {"emails": await self._run_imap(self.agent.list_latest_emails, count)}
+
+    async def fetch_email_body(self, uid: int):
+        """Download the text body of one email on demand"""
+        return {"uid": uid, "body": await self._run_imap(self.agent.fetch_body, uid)}
+
+    async def backfill_emails(self, on_batch, folder: str = "inbox", batch_size: int = 500, workers: int = None):
+        """
+        Stream every message in a folder, with MIME parsing spread over a process pool.
+        on_batch(emails) is called on the IMAP worker thread for each batch, in UID order.
+        """
+        def run():
+            total = 0
+            for batch in itertools.batched(self.agent.backfill_emails(workers=workers), batch_size):
+                on_batch(list(batch))
+                total += len(batch)
+            return total
+
+        # A backfill takes as long as the mailbox is big; the socket timeout still guards against stalls
+        return await self._run_imap(run, folder=folder, timeout=None)
+
+    def start_watching(self, on_new_mail, folder: str = "inbox"):
+        """Listen for new mail with IMAP IDLE on a separate connection; on_new_mail runs on the watcher thread"""
+        watcher = self.watchers.get(folder)
+        if watcher is None:
+            idle_agent = EmailFetchAgent(email_address=EMAIL, app_password=PASSWORD)
+            watcher = self.watchers[folder] = ImapIdleWatcher(idle_agent, on_new_mail, folder)
+        watcher.start()
+        return watcher
+
+    def stop_watching(self):
+        for watcher in self.watchers.values():
+            watcher.stop()
+        self.watchers.clear()
 
     async def handle_task(self, task: str, **kwargs):
         """Handle various email-related tasks"""
@@ -32,6 +116,51 @@ class EmailAgent:
     
     async def send_emails(self,sub : str, to : str, body : str):
         try:
-            return self.send_agent.send_email(sub,to,body)
+            return await self._run_smtp(self.send_agent.send_email, sub, to, body)
+        except Exception as e:
+            return {"error": str(e)}
+
+    def start_outbox(self, db_conn):
+        """Start the delivery workers, once; anything a previous run left queued is picked up too"""
+        if self.outbox_workers:
+            return
+        requeue_interrupted_outbox(db_conn)
+        self.outbox_wakeup = asyncio.Event()
+        self.outbox_workers = [asyncio.create_task(self._outbox_worker(db_conn)) for _ in range(SMTP_WORKERS)]
+
+    async def queue_email(self, db_conn, sub: str, to: str, body: str):
+        """Store the email in the outbox and return its id; a background worker delivers it"""
+        outbox_id = enqueue_outbox(db_conn, sub, to, body)
+        self.start_outbox(db_conn)
+        self.outbox_wakeup.set()
+        return outbox_id
+
+    async def _outbox_worker(self, db_conn):
+        while True:
+            item = claim_outbox(db_conn)
+            if item is None:
+                self.outbox_wakeup.clear()
+                due = next_outbox_due(db_conn)
+                wait = OUTBOX_POLL if due is None else min(max(due - time.time(), 0), OUTBOX_POLL)
+                try:
+                    await asyncio.wait_for(self.outbox_wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._deliver(db_conn, item)
+
+    async def _deliver(self, db_conn, item):
+        try:
+            await self._run_smtp(self.send_agent.send_email, item["subject"], item["recipient"], item["body"])
+        except PERMANENT_SMTP_ERRORS as e:
+            finish_outbox(db_conn, item["id"], "failed", str(e))
         except Exception as e:
-            return {"error",str(e)}
\ No newline at end of file
+            if item["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                print(f"Debug: Giving up on outbox email {item['id']} after {item['attempts']} attempts: {e}")
+                finish_outbox(db_conn, item["id"], "failed", str(e))
+            else:
+                delay = min(OUTBOX_RETRY_BASE * 2 ** (item["attempts"] - 1), OUTBOX_RETRY_MAX)
+                print(f"Debug: Outbox email {item['id']} failed ({e}), retrying in {delay}s")
+                finish_outbox(db_conn, item["id"], "queued", str(e), time.time() + delay)
+        else:
+            finish_outbox(db_conn, item["id"], "sent")
@@ -1,8 +1,7 @@
 import os
 import asyncio
 from dotenv import load_dotenv, find_dotenv
-from server.t_get_msgs import TelegramBotServer
-from telethon import TelegramClient
+from server.t_get_msgs import TelegramBotServer, CHAT_LIMIT, PER_CHAT, HISTORY_CONCURRENCY
 
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 if os.path.exists(dotenv_path):
@@ -14,25 +13,46 @@ app_id = os.environ["TELEGRAM_APP_API"]
 app_hash_id = os.environ["TELEGRAM_APP_HASH"]
 phone_number = os.environ["PHONE_NUMBER"]
 
+TELEGRAM_CHAT_LIMIT = int(os.getenv("TELEGRAM_CHAT_LIMIT", str(CHAT_LIMIT)))
+TELEGRAM_PER_CHAT = int(os.getenv("TELEGRAM_PER_CHAT", str(PER_CHAT)))
+TELEGRAM_CONCURRENCY = int(os.getenv("TELEGRAM_CONCURRENCY", str(HISTORY_CONCURRENCY)))
+
 class TelegramAgent:
     def __init__(self):
         self.get_agent = TelegramBotServer(app_id, app_hash_id)
 
-    async def fetch_messages(self):
-        result = await self.get_agent.fetch_messages()
+    async def fetch_messages(self, chat_limit=None, per_chat=None):
+        result = await self.get_agent.fetch_messages(
+            chat_limit or TELEGRAM_CHAT_LIMIT,
+            per_chat or TELEGRAM_PER_CHAT,
+            TELEGRAM_CONCURRENCY
+        )
         if result:
             return {str(chat_id): msgs for chat_id, msgs in result.items()}
         else:
             return {"AGENT" : "Nothing is fetched from telegram_agent.py"}
+
+    async def sync_messages(self, watermarks, chat_limit=None, per_chat=None):
+        """Only messages newer than the per-chat watermarks; returns {"chats", "last_ids"}."""
+        chats, last_ids = await self.get_agent.sync_messages(
+            watermarks,
+            chat_limit or TELEGRAM_CHAT_LIMIT,
+            per_chat or TELEGRAM_PER_CHAT,
+            TELEGRAM_CONCURRENCY
+        )
+        return {"chats": dict(chats), "last_ids": last_ids}
+
+    async def start_watching(self, on_batch):
+        """on_batch(chats, last_ids) is awaited with each micro-batch of new or edited messages"""
+        await self.get_agent.start_listening(on_batch)
+
+    async def stop_watching(self):
+        await self.get_agent.stop_listening()
         
     async def send_message(self, to: str, body: str):
-        result = await asyncio.wait_for(
-            self._send_message_internal(to, body),
+        # Same client and session as fetching, so a send doesn't pay for a fresh connect and login
+        sent_message = await asyncio.wait_for(
+            self.get_agent.send_message(to, body),
             timeout=30.0
         )
-        return result
-    
-    async def _send_message_internal(self, to: str, body: str):
-        async with TelegramClient("send_message_session", int(app_id), app_hash_id) as client:
-            sent_message = await client.send_message(to, body)
-            return {"status": "success", "message_id": sent_message.id}
\ No newline at end of file
+        return {"status": "success", "message_id": sent_message.id}
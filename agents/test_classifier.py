@@ -1,4 +1,11 @@
-from Classifier import ClassifierAgent
+import os
+import sys
+
+# Classifier loads its model through the top-level models module, so put the repo root on the path;
+# this keeps both `python agents/test_classifier.py` and `python -m agents.test_classifier` working
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.Classifier import ClassifierAgent
 
 
 def run_tests():
@@ -0,0 +1,57 @@
+import time
+from bs4 import BeautifulSoup
+import re
+from server.getting_mail import html_to_text
+
+SAMPLE_PATH = "sample.html"
+ROUNDS = 200
+
+
+def bs4_strip_html_tags(html):
+    """The previous EmailFetchAgent.strip_html_tags, kept here as the baseline"""
+    soup = BeautifulSoup(html, "html.parser")
+
+    for script in soup(["script", "style"]):
+        script.decompose()
+
+    text = soup.get_text(separator=" ", strip=True)
+    text = re.sub(r'[\u200b\u200c\u200d\u2007\u2060\ufeff\u00a0]+', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+
+    return text.strip()
+
+
+def bench(name, fn, body, rounds=ROUNDS):
+    fn(body)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        out = fn(body)
+    per_call = (time.perf_counter() - start) / rounds
+    print(f"{name:<28} {per_call * 1e6:10.1f} us/call   {len(out):7d} chars out")
+    return per_call
+
+
+def run():
+    with open(SAMPLE_PATH, encoding="utf-8") as f:
+        html = f.read()
+
+    # A newsletter-sized body: the sample repeated to roughly 400 KB
+    newsletter = html * 50
+    plain = "Hi there,\n\nYour order has shipped and will arrive on Friday.\n\nThanks!\n" * 20
+
+    print(f"sample.html: {len(html)} chars, newsletter: {len(newsletter)} chars, plain: {len(plain)} chars\n")
+
+    for label, body, rounds in (("sample.html", html, ROUNDS), ("newsletter", newsletter, 10), ("plain text", plain, ROUNDS)):
+        old = bench(f"bs4 {label}", bs4_strip_html_tags, body, rounds)
+        new = bench(f"html_to_text {label}", html_to_text, body, rounds)
+        print(f"{'speedup':<28} {old / new:10.1f}x\n")
+
+    # Same visible text as the old path, modulo the size cap
+    assert html_to_text(html) == bs4_strip_html_tags(html)[:len(html_to_text(html))]
+    # An HTML part with entities but no tags takes the fast path and must still decode them
+    entities_only = "Fish &amp; chips &nbsp; for &pound;5 &#8211; today"
+    assert html_to_text(entities_only) == bs4_strip_html_tags(entities_only)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import time
+import numpy as np
+from db import init_db
+from embed import vector_to_blob, EMBED_DIM, VECTOR_DTYPE
+from vector_store import Vec0Store, FaissStore
+
+BENCH_DB = "bench_vectors.db"
+BENCH_INDEX = "bench_vectors.faiss"
+BASE_TS = 1_700_000_000
+
+
+def synthetic_vectors(n, seed=0, topics=256, subtopics=64):
+    """
+    Unit vectors around a two-level hierarchy of random centres. Real sentence embeddings are
+    clustered like this; uniform noise in 384 dimensions has no meaningful nearest neighbours.
+    """
+    centres = np.random.default_rng(0)
+    topic = centres.standard_normal((topics, EMBED_DIM))
+    subtopic = topic[np.arange(topics * subtopics) // subtopics] + 0.5 * centres.standard_normal((topics * subtopics, EMBED_DIM))
+    rng = np.random.default_rng(seed)
+    vectors = subtopic[rng.integers(0, len(subtopic), n)] + 0.25 * rng.standard_normal((n, EMBED_DIM))
+    vectors = vectors.astype(VECTOR_DTYPE)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_db(path, n, chunk=10_000):
+    if os.path.exists(path):
+        os.remove(path)
+    db_conn, cursor = init_db(path)
+    vectors = synthetic_vectors(n)
+    started = time.perf_counter()
+    for start in range(0, n, chunk):
+        rows = range(start, min(start + chunk, n))
+        with db_conn:
+            cursor.executemany(
+                "INSERT INTO metadata (id, source, sender, timestamp, is_read, content, subject, ts) VALUES (?, ?, ?, '', 1, '', '', ?)",
+                [(f"m{i}", "email" if i % 4 else "telegram", f"user{i % 50}", BASE_TS + i) for i in rows]
+            )
+            cursor.executemany(
+                "INSERT INTO vectors (id, source, embedding, sender, ts) VALUES (?, ?, ?, ?, ?)",
+                [(f"m{i}", "email" if i % 4 else "telegram", vector_to_blob(vectors[i]), f"user{i % 50}", BASE_TS + i) for i in rows]
+            )
+    print(f"Loaded {n} vectors in {time.perf_counter() - started:.1f}s")
+    return db_conn
+
+
+def timed_search(store, db_conn, queries, k, filters):
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append([msg_id for msg_id, _ in store.search(db_conn, query, k, filters)])
+        latencies.append(time.perf_counter() - started)
+    return results, np.array(latencies) * 1000
+
+
+def recall(truth, found):
+    return np.mean([len(set(t) & set(f)) / len(t) for t, f in zip(truth, found) if t])
+
+
+def report(label, latencies, recall_at_k=None):
+    p50, p95 = np.percentile(latencies, [50, 95])
+    recall_text = f"   recall {recall_at_k:.3f}" if recall_at_k is not None else ""
+    print(f"{label:<28} p50 {p50:8.2f} ms   p95 {p95:8.2f} ms{recall_text}")
+
+
+def run(n, queries, k, ef_values, db_path=BENCH_DB, index_path=BENCH_INDEX):
+    db_conn = build_db(db_path, n)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    started = time.perf_counter()
+    faiss_store = FaissStore(db_path, index_path)
+    faiss_store.close()
+    print(f"HNSW build + save: {time.perf_counter() - started:.1f}s, {os.path.getsize(index_path) / 1e6:.0f} MB on disk")
+
+    # A second store loads the saved index, as a restarted server would
+    started = time.perf_counter()
+    faiss_store = FaissStore(db_path, index_path)
+    print(f"HNSW load: {(time.perf_counter() - started) * 1000:.0f} ms\n")
+
+    vec0_store = Vec0Store()
+    query_vectors = synthetic_vectors(queries, seed=1)
+    for label, filters in (("", None), (" source=telegram", {"source": "telegram"}), (" sender=user7", {"sender": "user7"})):
+        truth, vec0_ms = timed_search(vec0_store, db_conn, query_vectors, k, filters)
+        report(f"vec0{label}", vec0_ms)
+        for ef in ef_values:
+            faiss_store.set_ef_search(ef)
+            found, faiss_ms = timed_search(faiss_store, db_conn, query_vectors, k, filters)
+            report(f"hnsw ef={ef}{label}", faiss_ms, recall(truth, found))
+        print()
+
+    db_conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of the FAISS HNSW store against exact vec0 KNN")
+    parser.add_argument("--n", type=int, default=100_000, help="vectors to load")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 64, 256], help="HNSW efSearch values to compare")
+    args = parser.parse_args()
+    run(args.n, args.queries, args.k, args.ef)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,238 @@
 import sqlite3
+import time
 import sqlite_vec
+import json
+from datetime import datetime
+from email.utils import parsedate_to_datetime, parseaddr
+from embed import vector_to_blob
 
-def init_db(db_path="data.db"):
-    db_conn = sqlite3.connect(db_path)
+def to_epoch(value, strict=False):
+    """
+    Unix seconds for a stored timestamp: ISO 8601 from IMAP, "YYYY-MM-DD HH:MM:SS" from pyrogram,
+    or an RFC 2822 date. Times without a zone are taken as local time, as pyrogram reports them.
+    Unparseable text gives None, or raises ValueError when strict (for user-supplied filters).
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, datetime):
+        text = str(value).strip()
+        try:
+            value = datetime.fromisoformat(text)
+        except ValueError:
+            try:
+                value = parsedate_to_datetime(text)
+            except (TypeError, ValueError):
+                if strict:
+                    raise ValueError(f"Unrecognised date {text!r}; use e.g. 2026-01-31 or 2026-01-31T09:00")
+                return None
+    return int(value.timestamp())
+
+def sender_key(sender):
+    """
+    The sender as stored in vectors for filtering: the lower-cased address for
+    "Name <addr>" email senders, otherwise the sender text itself (a Telegram chat name).
+    """
+    _, address = parseaddr(sender or "")
+    return address.lower() if "@" in address else (sender or "")
+
+# Seconds a connection waits on another connection's write lock before "database is locked"
+BUSY_TIMEOUT = 30
+
+# source is a partition key and sender/ts are metadata columns, so vec0 applies those filters
+# while it scans instead of after the top k are picked. vec0 metadata columns can't hold NULL.
+VECTORS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING vec0(
+        id TEXT PRIMARY KEY,
+        source TEXT PARTITION KEY,
+        embedding float[384],
+        sender TEXT,
+        ts INTEGER
+    )
+"""
+
+def _migrate_cache_to_blobs(cursor):
+    """Embedding cache rows written as JSON text are rewritten as packed float32."""
+    cursor.execute("SELECT text_hash, embedding FROM embedding_cache WHERE typeof(embedding) = 'text'")
+    rows = cursor.fetchall()
+    cursor.executemany(
+        "UPDATE embedding_cache SET embedding = ? WHERE text_hash = ?",
+        [(vector_to_blob(json.loads(emb)), key) for key, emb in rows]
+    )
+    if rows:
+        print(f"Migrated {len(rows)} cached embeddings to float32 blobs")
+
+def _add_content_hash(cursor):
+    """Fingerprint column so re-ingesting an unchanged message can be skipped."""
+    cursor.execute("ALTER TABLE metadata ADD COLUMN content_hash TEXT")
+
+def _drop_positional_telegram_ids(cursor):
+    """
+    Telegram rows used to be keyed tg_<chat name>_<list position>, which collided on every
+    sync. They are re-fetched under tg_<chat id>:<message id>, so the old rows are dropped.
+    """
+    cursor.execute("SELECT id FROM metadata WHERE id GLOB 'tg_*_[0-9]*' AND NOT id GLOB 'tg_*:[0-9]*'")
+    ids = [(row[0],) for row in cursor.fetchall()]
+    cursor.executemany("DELETE FROM metadata WHERE id = ?", ids)
+    cursor.executemany("DELETE FROM vectors WHERE id = ?", ids)
+    if ids:
+        print(f"Dropped {len(ids)} position-keyed telegram rows")
+
+METADATA_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS metadata_source_ts ON metadata (source, ts)",
+    "CREATE INDEX IF NOT EXISTS metadata_sender_ts ON metadata (sender, ts)",
+    "CREATE INDEX IF NOT EXISTS metadata_is_read_ts ON metadata (is_read, ts)",
+]
+
+def _add_epoch_ts(cursor):
+    """
+    timestamp holds text in several formats, so range filters compared strings. ts is the
+    same instant as integer Unix seconds, indexed for the common source/sender/unread filters.
+    """
+    cursor.execute("ALTER TABLE metadata ADD COLUMN ts INTEGER")
+    cursor.execute("SELECT id, timestamp FROM metadata")
+    rows = cursor.fetchall()
+    cursor.executemany("UPDATE metadata SET ts = ? WHERE id = ?", [(to_epoch(ts), msg_id) for msg_id, ts in rows])
+    for index in METADATA_INDEXES:
+        cursor.execute(index)
+    if rows:
+        print(f"Added epoch ts to {len(rows)} rows")
+
+FTS_SCHEMA = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS metadata_fts USING fts5(
+        content, subject, sender,
+        content='metadata', content_rowid='{rowid}',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+"""
+FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS metadata_fts_insert AFTER INSERT ON metadata BEGIN
+        INSERT INTO metadata_fts (rowid, content, subject, sender) VALUES (new.rowid, new.content, new.subject, new.sender);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS metadata_fts_delete AFTER DELETE ON metadata BEGIN
+        INSERT INTO metadata_fts (metadata_fts, rowid, content, subject, sender) VALUES ('delete', old.rowid, old.content, old.subject, old.sender);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS metadata_fts_update AFTER UPDATE ON metadata BEGIN
+        INSERT INTO metadata_fts (metadata_fts, rowid, content, subject, sender) VALUES ('delete', old.rowid, old.content, old.subject, old.sender);
+        INSERT INTO metadata_fts (rowid, content, subject, sender) VALUES (new.rowid, new.content, new.subject, new.sender);
+    END
+    """,
+]
+
+def _add_fts_index(cursor):
+    """
+    Full-text index over metadata for literal lookups (order numbers, names) that LIKE had to scan for.
+    It is external-content, so the text is stored once, and triggers keep it in step with metadata.
+    """
+    cursor.execute(FTS_SCHEMA.format(rowid="rowid"))
+    for trigger in FTS_TRIGGERS:
+        cursor.execute(trigger)
+    cursor.execute("INSERT INTO metadata_fts (metadata_fts) VALUES ('rebuild')")
+
+def _partition_vectors(cursor):
+    """
+    Rebuild vectors with the source partition key and sender/ts metadata columns.
+    vec0 tables can't be altered or renamed, so the vectors go through a plain table.
+    """
+    cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'vectors'")
+    if "PARTITION KEY" in cursor.fetchone()[0]:
+        return
+    cursor.execute("CREATE TABLE vectors_copy AS SELECT id, embedding FROM vectors")
+    cursor.execute("DROP TABLE vectors")
+    cursor.execute(VECTORS_SCHEMA.format(name="vectors"))
+    cursor.execute("""
+        INSERT INTO vectors (id, source, embedding, sender, ts)
+        SELECT c.id, COALESCE(m.source, ''), c.embedding, sender_key(m.sender), COALESCE(m.ts, 0)
+        FROM vectors_copy c
+        LEFT JOIN metadata m ON m.id = c.id
+    """)
+    print(f"Rebuilt {cursor.rowcount} vectors with source partitions and sender/ts columns")
+    cursor.execute("DROP TABLE vectors_copy")
+
+def _stable_rowids(cursor):
+    """
+    metadata is keyed by TEXT id, so its rowid was implicit and VACUUM is free to renumber it,
+    which would leave metadata_fts (and a FAISS index, also keyed by rowid) pointing at the wrong
+    rows. seq INTEGER PRIMARY KEY makes the rowid a real column that VACUUM keeps. Rows keep
+    their current rowids, so existing indexes stay valid.
+    """
+    cursor.execute("DROP TABLE IF EXISTS metadata_fts")
+    cursor.execute("""
+        CREATE TABLE metadata_new (
+            seq INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            source TEXT,
+            sender TEXT,
+            timestamp TEXT,
+            is_read INTEGER,
+            content TEXT,
+            subject TEXT,
+            content_hash TEXT,
+            ts INTEGER
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO metadata_new (seq, id, source, sender, timestamp, is_read, content, subject, content_hash, ts)
+        SELECT rowid, id, source, sender, timestamp, is_read, content, subject, content_hash, ts FROM metadata
+    """)
+    # Dropping metadata drops its triggers and indexes too; they are recreated on the new table
+    cursor.execute("DROP TABLE metadata")
+    cursor.execute("ALTER TABLE metadata_new RENAME TO metadata")
+    for index in METADATA_INDEXES:
+        cursor.execute(index)
+    cursor.execute(FTS_SCHEMA.format(rowid="seq"))
+    for trigger in FTS_TRIGGERS:
+        cursor.execute(trigger)
+    cursor.execute("INSERT INTO metadata_fts (metadata_fts) VALUES ('rebuild')")
+
+def _drop_positional_email_ids(cursor):
+    """
+    Email rows used to be keyed email_<position in the fetched batch>. Those databases predate the
+    UID watermark, so the next sync fetches the same mail again under its Message-ID; the old rows
+    would only turn up as duplicates. Ids from the UID or digest fallbacks never are digits alone.
+    """
+    cursor.execute("SELECT id FROM metadata WHERE id GLOB 'email_[0-9]*' AND NOT substr(id, 7) GLOB '*[^0-9]*'")
+    ids = [(row[0],) for row in cursor.fetchall()]
+    cursor.executemany("DELETE FROM metadata WHERE id = ?", ids)
+    cursor.executemany("DELETE FROM vectors WHERE id = ?", ids)
+    if ids:
+        print(f"Dropped {len(ids)} position-keyed email rows")
+
+# Applied in order; PRAGMA user_version records how many have run.
+MIGRATIONS = [
+    _migrate_cache_to_blobs,
+    _add_content_hash,
+    _drop_positional_telegram_ids,
+    _add_epoch_ts,
+    _add_fts_index,
+    _partition_vectors,
+    _stable_rowids,
+    _drop_positional_email_ids,
+]
+
+def migrate(db_conn):
+    cursor = db_conn.cursor()
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for step in MIGRATIONS[version:]:
+        step(cursor)
+    if version < len(MIGRATIONS):
+        cursor.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    db_conn.commit()
+
+def init_db(db_path="data.db", check_same_thread=True):
+    db_conn = sqlite3.connect(db_path, check_same_thread=check_same_thread, timeout=BUSY_TIMEOUT)
     db_conn.enable_load_extension(True)
     sqlite_vec.load(db_conn)
+    # WAL lets long reads (a FAISS rebuild scanning every vector) run alongside ingest writes
+    db_conn.execute("PRAGMA journal_mode=WAL")
+    # Lets metadata queries filter on sender the same way vectors.sender is matched
+    db_conn.create_function("sender_key", 1, sender_key, deterministic=True)
     cursor = db_conn.cursor()
     
     cursor.execute("""
@@ -19,12 +247,117 @@ def init_db(db_path="data.db"):
         )
     """)
     
+    cursor.execute(VECTORS_SCHEMA.format(name="vectors"))
+    
     cursor.execute("""
-        CREATE VIRTUAL TABLE IF NOT EXISTS vectors USING vec0(
-            id TEXT PRIMARY KEY,
-            embedding float[384]
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            text_hash TEXT PRIMARY KEY,
+            model TEXT,
+            embedding BLOB
+        )
+    """)
+    
+    # Per-source sync watermarks, e.g. ("email", "inbox") -> (UIDVALIDITY, last UID)
+    # or ("telegram", chat id) -> (NULL, last message id)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            source TEXT,
+            scope TEXT,
+            validity INTEGER,
+            last_id INTEGER,
+            PRIMARY KEY (source, scope)
         )
     """)
     
+    # Outgoing mail, kept until delivered so a crash or SMTP outage doesn't lose it
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject TEXT,
+            recipient TEXT,
+            body TEXT,
+            status TEXT DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            next_attempt REAL,
+            last_error TEXT,
+            created REAL,
+            sent_at REAL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt)")
+    
+    db_conn.commit()
+    migrate(db_conn)
+    return db_conn, cursor
+
+def get_sync_state(db_conn, source, scope):
+    """Return (validity, last_id) for a sync scope, or (None, 0) if it has never synced."""
+    row = db_conn.execute(
+        "SELECT validity, last_id FROM sync_state WHERE source = ? AND scope = ?",
+        (source, scope)
+    ).fetchone()
+    return (row[0], row[1] or 0) if row else (None, 0)
+
+def get_sync_states(db_conn, source):
+    """Every scope synced for a source, as {scope: (validity, last_id)}."""
+    rows = db_conn.execute(
+        "SELECT scope, validity, last_id FROM sync_state WHERE source = ?",
+        (source,)
+    ).fetchall()
+    return {scope: (validity, last_id or 0) for scope, validity, last_id in rows}
+
+def set_sync_state(db_conn, source, scope, validity, last_id):
+    db_conn.execute(
+        "INSERT OR REPLACE INTO sync_state (source, scope, validity, last_id) VALUES (?, ?, ?, ?)",
+        (source, scope, validity, last_id)
+    )
+    db_conn.commit()
+
+
+OUTBOX_COLUMNS = ("id", "subject", "recipient", "body", "status", "attempts", "next_attempt", "last_error", "created", "sent_at")
+
+def enqueue_outbox(db_conn, subject, recipient, body):
+    """Store a message for delivery and return its outbox id."""
+    now = time.time()
+    cursor = db_conn.execute(
+        "INSERT INTO outbox (subject, recipient, body, status, next_attempt, created) VALUES (?, ?, ?, 'queued', ?, ?)",
+        (subject, recipient, body, now, now)
+    )
+    db_conn.commit()
+    return cursor.lastrowid
+
+def claim_outbox(db_conn):
+    """Mark the oldest due message as sending and return it, or None if nothing is due."""
+    row = db_conn.execute(
+        "SELECT id FROM outbox WHERE status = 'queued' AND next_attempt <= ? ORDER BY next_attempt, id LIMIT 1",
+        (time.time(),)
+    ).fetchone()
+    if row is None:
+        return None
+    db_conn.execute("UPDATE outbox SET status = 'sending', attempts = attempts + 1 WHERE id = ?", (row[0],))
+    db_conn.commit()
+    return get_outbox(db_conn, row[0])
+
+def next_outbox_due(db_conn):
+    """Time the next queued message becomes due, or None if the queue is empty."""
+    return db_conn.execute("SELECT MIN(next_attempt) FROM outbox WHERE status = 'queued'").fetchone()[0]
+
+def finish_outbox(db_conn, outbox_id, status, error=None, retry_at=None):
+    """Record a delivery attempt: 'sent', 'failed', or back to 'queued' until retry_at."""
+    db_conn.execute(
+        "UPDATE outbox SET status = ?, last_error = ?, next_attempt = COALESCE(?, next_attempt), sent_at = ? WHERE id = ?",
+        (status, error, retry_at, time.time() if status == "sent" else None, outbox_id)
+    )
     db_conn.commit()
-    return db_conn, cursor
\ No newline at end of file
+
+def requeue_interrupted_outbox(db_conn):
+    """Messages left 'sending' by a crash are tried again; delivery is at-least-once."""
+    db_conn.execute("UPDATE outbox SET status = 'queued' WHERE status = 'sending'")
+    db_conn.commit()
+
+def get_outbox(db_conn, outbox_id):
+    row = db_conn.execute(
+        f"SELECT {', '.join(OUTBOX_COLUMNS)} FROM outbox WHERE id = ?",
+        (outbox_id,)
+    ).fetchone()
+    return dict(zip(OUTBOX_COLUMNS, row)) if row else None
@@ -1,7 +1,28 @@
-from sentence_transformers import SentenceTransformer
+import numpy as np
+from models import get_model, MINILM
 
-embed_model = SentenceTransformer('all-MiniLM-L6-v2')
+EMBED_MODEL_NAME = MINILM
+EMBED_DIM = 384
+EMBED_BATCH_SIZE = 64
+
+# sqlite-vec reads raw little-endian float32, so vectors are passed as packed buffers
+VECTOR_DTYPE = np.dtype('<f4')
 
 def get_embedding(text):
-    vector = embed_model.encode(text)
-    return vector.tolist()
\ No newline at end of file
+    vector = get_model(EMBED_MODEL_NAME).encode(text, convert_to_numpy=True)
+    return np.ascontiguousarray(vector, dtype=VECTOR_DTYPE)
+
+def vector_to_blob(vec):
+    return np.ascontiguousarray(vec, dtype=VECTOR_DTYPE).tobytes()
+
+def blob_to_vector(blob):
+    return np.frombuffer(blob, dtype=VECTOR_DTYPE)
+
+def get_embeddings(texts, batch_size=EMBED_BATCH_SIZE):
+    """Encode a list of texts in one pass, returning a contiguous (n, dim) float32 matrix."""
+    texts = list(texts)
+    if not texts:
+        return np.empty((0, EMBED_DIM), dtype=VECTOR_DTYPE)
+
+    vectors = get_model(EMBED_MODEL_NAME).encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    return np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE)
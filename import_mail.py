@@ -0,0 +1,64 @@
+import argparse
+import itertools
+import os
+from db import init_db
+from ingest import ingest_emails, import_with_checkpoint, INGEST_BATCH_SIZE
+from server.getting_mail import parse_emails
+
+
+def iter_mbox(path):
+    """Yield raw messages from an mbox file one at a time, never holding more than one in memory."""
+    with open(path, "rb") as f:
+        lines = []
+        for line in f:
+            if line.startswith(b"From "):
+                if lines:
+                    yield b"".join(lines)
+                lines = []
+                continue
+            lines.append(line)
+        if lines:
+            yield b"".join(lines)
+
+
+def iter_eml_dir(path):
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(".eml"):
+            with open(os.path.join(path, name), "rb") as f:
+                yield f.read()
+
+
+def source_fingerprint(path):
+    """Changes when the input changes, so a stale checkpoint is not resumed against different data."""
+    if os.path.isdir(path):
+        return sum(1 for name in os.listdir(path) if name.lower().endswith(".eml"))
+    return os.path.getsize(path)
+
+
+def import_mail(path, db_path="data.db", batch_size=INGEST_BATCH_SIZE, workers=None, resume=True):
+    db_conn, _ = init_db(db_path)
+
+    def open_rows(done):
+        raws = iter_eml_dir(path) if os.path.isdir(path) else iter_mbox(path)
+        # Messages before the checkpoint are read past without being parsed
+        return parse_emails(itertools.islice(raws, done, None), workers)
+
+    imported = import_with_checkpoint(db_conn, path, source_fingerprint(path), open_rows, ingest_emails, batch_size, resume)
+    db_conn.close()
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import an mbox file or a directory of .eml files into the vector store")
+    parser.add_argument("path", help="mbox file (e.g. a Google Takeout export) or directory of .eml files")
+    parser.add_argument("--db", default="data.db", help="database to import into")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="messages per ingest transaction")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: all cores)")
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint and start from the beginning")
+    args = parser.parse_args()
+
+    import_mail(args.path, args.db, args.batch_size, args.workers, resume=not args.restart)
+
+
+if __name__ == "__main__":
+    main()
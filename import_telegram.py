@@ -0,0 +1,207 @@
+import argparse
+import itertools
+import json
+import os
+from db import init_db
+from ingest import add_msgs, import_with_checkpoint, telegram_msg_id, INGEST_BATCH_SIZE
+
+READ_CHUNK = 1 << 16
+
+# Telegram Desktop exports bare ids; the API (and so the live sync) prefixes groups and channels
+SUPERGROUP_TYPES = {"private_supergroup", "public_supergroup", "private_channel", "public_channel"}
+GROUP_TYPES = {"private_group"}
+
+
+class JsonStream:
+    """
+    Walks a JSON document from a file a chunk at a time. Containers are entered with
+    iter_object()/iter_array() and only the values asked for with value() are decoded,
+    so a multi-hundred-MB export never has to fit in memory.
+    """
+
+    def __init__(self, f, chunk_size=READ_CHUNK):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch):
+        found = self.peek()
+        if found != ch:
+            raise ValueError(f"Expected {ch!r} in JSON stream, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number that ends at the buffer edge may continue in the next chunk
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def skip(self):
+        """Step over the next value without decoding large containers in one piece."""
+        ch = self.peek()
+        if ch == "{":
+            for _ in self.iter_object():
+                self.skip()
+        elif ch == "[":
+            for _ in self.iter_array():
+                self.skip()
+        else:
+            self.value()
+
+    def _close(self, end):
+        ch = self.peek()
+        self.pos += 1
+        if ch == end:
+            return True
+        if ch != ",":
+            raise ValueError(f"Expected ',' or {end!r} in JSON stream, found {ch!r}")
+        return False
+
+    def iter_object(self):
+        """Yield each key; the caller must consume its value before asking for the next key."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self._close("}"):
+                return
+
+    def iter_array(self):
+        """Yield once per element; the caller must consume the element each time."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self._close("]"):
+                return
+
+
+def _iter_chat(stream, chat):
+    """Yield (chat, message) for a chat object; scalar fields before "messages" fill in chat."""
+    for key in stream.iter_object():
+        if key == "messages":
+            for _ in stream.iter_array():
+                yield chat, stream.value()
+        elif stream.peek() in "[{":
+            stream.skip()
+        else:
+            chat[key] = stream.value()
+
+
+def iter_export(f):
+    """
+    Yield (chat, message) pairs from a result.json. Handles both a single chat export
+    (the top level is the chat) and a full account export (chats.list / left_chats.list).
+    """
+    stream = JsonStream(f)
+    top = {}
+    for key in stream.iter_object():
+        if key == "messages":
+            for _ in stream.iter_array():
+                yield top, stream.value()
+        elif key in ("chats", "left_chats") and stream.peek() == "{":
+            for section_key in stream.iter_object():
+                if section_key == "list":
+                    for _ in stream.iter_array():
+                        yield from _iter_chat(stream, {})
+                else:
+                    stream.skip()
+        elif stream.peek() in "[{":
+            stream.skip()
+        else:
+            top[key] = stream.value()
+
+
+def chat_id(chat):
+    """The id the Telegram API would report for this chat, so imports and live syncs share message ids."""
+    raw = chat.get("id")
+    if raw is None:
+        return chat.get("name") or "unknown"
+    if chat.get("type") in SUPERGROUP_TYPES:
+        return -(10 ** 12 + raw)
+    if chat.get("type") in GROUP_TYPES:
+        return -raw
+    return raw
+
+
+def message_text(text):
+    """Exports split formatted text into a list of strings and {"type", "text"} entities."""
+    if isinstance(text, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text or ""
+
+
+def iter_rows(f):
+    """Yield one metadata row per message in the export, or None for messages with nothing to index."""
+    for chat, msg in iter_export(f):
+        txt = message_text(msg.get("text"))
+        if msg.get("type", "message") != "message" or not txt.strip():
+            yield None
+            continue
+        chat_name = chat.get("name") or msg.get("from") or "Unknown"
+        msg_date = msg.get("date", "").replace("T", " ")
+        yield (telegram_msg_id(chat_id(chat), msg.get("id")), "telegram", chat_name, msg_date, 1, txt, "This is a telegram message")
+
+
+def import_telegram(path, db_path="data.db", batch_size=INGEST_BATCH_SIZE, resume=True):
+    db_conn, _ = init_db(db_path)
+
+    def open_rows(done):
+        with open(path, encoding="utf-8") as f:
+            # Messages before the checkpoint are read past but not ingested again
+            yield from itertools.islice(iter_rows(f), done, None)
+
+    imported = import_with_checkpoint(db_conn, path, os.path.getsize(path), open_rows, add_msgs, batch_size, resume)
+    db_conn.close()
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a Telegram Desktop result.json export into the vector store")
+    parser.add_argument("path", help="result.json from Telegram Desktop's Export chat history (JSON format)")
+    parser.add_argument("--db", default="data.db", help="database to import into")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE, help="messages per ingest transaction")
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint and start from the beginning")
+    args = parser.parse_args()
+
+    import_telegram(args.path, args.db, args.batch_size, resume=not args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,214 @@
-import json
-from embed import get_embedding
+import os
+import time
+import hashlib
+import itertools
+import numpy as np
+from embed import get_embedding, get_embeddings, vector_to_blob, blob_to_vector, EMBED_BATCH_SIZE, EMBED_MODEL_NAME, VECTOR_DTYPE
+from db import to_epoch, sender_key, get_sync_state, set_sync_state
 
-def add_msg(db_conn, msg_id, src, sndr, ts, is_read, txt, sub):
+# Rows written per transaction by add_msgs
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+
+# sync_state source used for import checkpoints; the scope is the absolute path being imported
+IMPORT_CHECKPOINT = "import"
+
+# SQLite caps bound parameters per statement, so IN (...) lookups go in chunks.
+LOOKUP_CHUNK = 500
+
+def _lookup_in_chunks(cursor, query, keys, *params):
+    """Run a query with one `{placeholders}` slot over keys, LOOKUP_CHUNK at a time."""
+    rows = []
+    for start in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[start:start + LOOKUP_CHUNK]
+        cursor.execute(query.format(placeholders=",".join("?" * len(chunk))), (*params, *chunk))
+        rows.extend(cursor.fetchall())
+    return rows
+
+def row_hash(row):
+    """Fingerprint of a (msg_id, src, sndr, ts, is_read, txt, sub) row, used to skip unchanged messages."""
+    payload = "\0".join(str(field) for field in row[1:])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def email_msg_id(e):
+    """Stable id for a fetched email: Message-ID, else IMAP UIDVALIDITY/UID, else a header digest."""
+    message_id = (e.get("message_id") or "").strip().strip("<>")
+    if message_id:
+        return f"email_{message_id}"
+    
+    if e.get("uid") and e.get("uidvalidity"):
+        return f"email_{e['uidvalidity']}_{e['uid']}"
+    
+    digest = hashlib.sha256(
+        "\0".join(str(e.get(key, "")) for key in ("from", "date", "subject")).encode("utf-8")
+    ).hexdigest()
+    return f"email_{digest[:24]}"
+
+def telegram_msg_id(chat_id, message_id):
+    """Stable id for a Telegram message; message ids are only unique within their chat."""
+    return f"tg_{chat_id}:{message_id}"
+
+def text_hash(txt, model=EMBED_MODEL_NAME):
+    normalized = " ".join(str(txt).split())
+    return hashlib.sha256(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+def get_cached_embeddings(db_conn, texts, batch_size=EMBED_BATCH_SIZE, model=EMBED_MODEL_NAME):
+    """Embed texts, reusing vectors from embedding_cache and only running the model on misses."""
+    if not texts:
+        return get_embeddings([])
+    
+    keys = [text_hash(txt, model) for txt in texts]
     cursor = db_conn.cursor()
     
-    cursor.execute(
-        "INSERT OR REPLACE INTO metadata (id, source, sender, timestamp, is_read, content, subject) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (msg_id, src, sndr, ts, is_read, txt, sub)
+    rows = _lookup_in_chunks(
+        cursor,
+        "SELECT text_hash, embedding FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})",
+        list(dict.fromkeys(keys)),
+        model
     )
+    cached = {key: blob_to_vector(emb) for key, emb in rows}
     
-    vec = get_embedding(txt)
+    misses = {}
+    for key, txt in zip(keys, texts):
+        if key not in cached and key not in misses:
+            misses[key] = txt
     
-    cursor.execute(
-        "INSERT OR REPLACE INTO vectors (id, embedding) VALUES (?, ?)",
-        (msg_id, json.dumps(vec))
-    )
+    if misses:
+        new_vectors = get_embeddings(list(misses.values()), batch_size=batch_size)
+        cursor.executemany(
+            "INSERT OR REPLACE INTO embedding_cache (text_hash, model, embedding) VALUES (?, ?, ?)",
+            [(key, model, vector_to_blob(vec)) for key, vec in zip(misses, new_vectors)]
+        )
+        cached.update(zip(misses, new_vectors))
+    
+    return np.ascontiguousarray(np.stack([cached[key] for key in keys]), dtype=VECTOR_DTYPE)
+
+# ts is derived from the timestamp text on write, so rows keep their original date string too.
+# An upsert rather than INSERT OR REPLACE: REPLACE deletes without firing the FTS delete trigger
+# and gives the row a new rowid, which would leave stale entries in metadata_fts.
+METADATA_UPSERT = """
+    INSERT INTO metadata (id, source, sender, timestamp, is_read, content, subject, content_hash, ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        source = excluded.source, sender = excluded.sender, timestamp = excluded.timestamp,
+        is_read = excluded.is_read, content = excluded.content, subject = excluded.subject,
+        content_hash = excluded.content_hash, ts = excluded.ts
+"""
+VECTOR_DELETE = "DELETE FROM vectors WHERE id = ?"
+VECTOR_INSERT = "INSERT INTO vectors (id, source, embedding, sender, ts) VALUES (?, ?, ?, ?, ?)"
+
+def vector_params(row, vec):
+    """VECTOR_INSERT parameters; the filter columns are copied from the metadata row."""
+    msg_id, src, sndr, ts = row[:4]
+    return (msg_id, src or "", vector_to_blob(vec), sender_key(sndr), to_epoch(ts) or 0)
+
+def add_msg(db_conn, msg_id, src, sndr, ts, is_read, txt, sub, vec=None):
+    cursor = db_conn.cursor()
+    
+    row = (msg_id, src, sndr, ts, is_read, txt, sub)
+    cursor.execute(METADATA_UPSERT, (*row, row_hash(row), to_epoch(ts)))
+    
+    if vec is None:
+        vec = get_embedding(txt)
+    
+    # vec0 does not honour OR REPLACE, so clear any previous vector first.
+    cursor.execute(VECTOR_DELETE, (msg_id,))
+    cursor.execute(VECTOR_INSERT, vector_params(row, vec))
     
     db_conn.commit()
 
-def ingest_emails(db_conn, emails):
-    for idx, e in enumerate(emails):
-        msg_id = f"email_{idx}"
+def add_msgs(db_conn, rows, batch_size=INGEST_BATCH_SIZE, embed_batch_size=EMBED_BATCH_SIZE):
+    """
+    Bulk-write (msg_id, src, sndr, ts, is_read, txt, sub) rows.
+    Each batch is embedded together and written with executemany in a single transaction.
+    Rows already stored with the same content are skipped.
+    """
+    # Later rows win if the same id shows up twice, as they would with the upsert.
+    rows = list({row[0]: row for row in rows}.values())
+    cursor = db_conn.cursor()
+    started = time.perf_counter()
+    
+    hashes = {row[0]: row_hash(row) for row in rows}
+    stored = _lookup_in_chunks(
+        cursor,
+        "SELECT id, content_hash FROM metadata WHERE id IN ({placeholders})",
+        list(hashes)
+    )
+    unchanged = {msg_id for msg_id, stored_hash in stored if stored_hash == hashes[msg_id]}
+    skipped = len(unchanged)
+    rows = [row for row in rows if row[0] not in unchanged]
+    
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        vectors = get_cached_embeddings(db_conn, [row[5] for row in batch], batch_size=embed_batch_size)
+        
+        with db_conn:
+            cursor.executemany(METADATA_UPSERT, [(*row, hashes[row[0]], to_epoch(row[3])) for row in batch])
+            cursor.executemany(VECTOR_DELETE, [(row[0],) for row in batch])
+            cursor.executemany(VECTOR_INSERT, [vector_params(row, vec) for row, vec in zip(batch, vectors)])
+    
+    elapsed = time.perf_counter() - started
+    rate = len(rows) / elapsed if elapsed > 0 else 0.0
+    if rows or skipped:
+        print(f"Ingested {len(rows)} rows in {elapsed:.2f}s ({rate:.1f} rows/sec), {skipped} unchanged")
+    return {"rows": len(rows), "skipped": skipped, "seconds": elapsed, "rows_per_sec": rate, "ids": [row[0] for row in rows]}
+
+def import_with_checkpoint(db_conn, path, fingerprint, open_rows, ingest, batch_size=INGEST_BATCH_SIZE, resume=True):
+    """
+    Feed an offline export through ingest(db_conn, rows, batch_size) a batch at a time, saving a
+    checkpoint after each committed batch so an interrupted import resumes where it stopped.
+    open_rows(done) yields one item per source message after the first `done` (None for a message
+    with nothing to store); fingerprint changes when the source does, so a stale checkpoint is ignored.
+    """
+    scope = os.path.abspath(path)
+
+    done = 0
+    if resume:
+        saved_fingerprint, saved_done = get_sync_state(db_conn, IMPORT_CHECKPOINT, scope)
+        if saved_fingerprint == fingerprint:
+            done = saved_done
+    if done:
+        print(f"Resuming {path} after {done} messages")
+
+    started = time.perf_counter()
+    imported = 0
+    # Positions count skipped messages too, so the checkpoint always points past what was read
+    for batch in itertools.batched(enumerate(open_rows(done), start=done), batch_size):
+        ingest(db_conn, [row for _, row in batch if row is not None], batch_size)
+        done = batch[-1][0] + 1
+        imported += len(batch)
+        # Checkpoint only after the batch is committed, so a crash resumes at a batch boundary
+        set_sync_state(db_conn, IMPORT_CHECKPOINT, scope, fingerprint, done)
+
+        elapsed = time.perf_counter() - started
+        print(f"{done} messages done, {imported / elapsed:.1f} msgs/sec over {elapsed:.1f}s")
+
+    elapsed = time.perf_counter() - started
+    print(f"Imported {imported} messages from {path} in {elapsed:.1f}s")
+    return imported
+
+def ingest_emails(db_conn, emails, batch_size=INGEST_BATCH_SIZE):
+    rows = []
+    for e in emails:
+        msg_id = email_msg_id(e)
         is_read = 0 if e.get("unread") == False else 1
         ts = e.get("date", "")
         txt = e.get("body", "")
         sndr = e.get("from", "unknown")
         sub = e.get("subject", "")
         
-        add_msg(db_conn, msg_id, "email", sndr, ts, is_read, txt, sub)
+        rows.append((msg_id, "email", sndr, ts, is_read, txt, sub))
+    
+    return add_msgs(db_conn, rows, batch_size)
 
-def ingest_telegram(db_conn, tg_data):
+def ingest_telegram(db_conn, tg_data, batch_size=INGEST_BATCH_SIZE):
+    rows = []
     for chat_name, msgs in tg_data.items():
         for idx, msg in enumerate(msgs):
-            msg_id = f"tg_{chat_name}_{idx}"
+            if isinstance(msg, dict) and msg.get('id') is not None:
+                msg_id = telegram_msg_id(msg.get('chat_id', chat_name), msg['id'])
+            else:
+                # Messages without Telegram ids can only be keyed by position
+                msg_id = f"tg_{chat_name}_{idx}"
             
             if hasattr(msg, 'text') and msg.text:
                 txt = msg.text
@@ -53,4 +229,6 @@ def ingest_telegram(db_conn, tg_data):
             else:
                 msg_date = msg.get('date', "") if isinstance(msg, dict) else ""
             
-            add_msg(db_conn, msg_id, "telegram", chat_name, msg_date, 1, txt, "This is a telegram message")
\ No newline at end of file
+            rows.append((msg_id, "telegram", chat_name, msg_date, 1, txt, "This is a telegram message"))
+    
+    return add_msgs(db_conn, rows, batch_size)
@@ -3,7 +3,11 @@ from agents.email_agent import EmailAgent
 from agents.Classifier import ClassifierAgent
 from agents.LLMchatbot import LLMChatBot
 from agents.telegram_agent import TelegramAgent
+from models import warm_up, ZERO_SHOT
+from db import init_db, get_outbox
+from contextlib import asynccontextmanager
 import json
+import os
 import uvicorn
 
 # Create FastMCP server
@@ -16,6 +20,13 @@ classifier_agent = ClassifierAgent()
 bot = LLMChatBot()
 telegram_bot = TelegramAgent()
 
+# Holds the email outbox; delivery runs on the event loop, so the connection is shared with it
+db_conn, _ = init_db("data.db", check_same_thread=False)
+
+# Models load lazily on first use; set MODEL_WARMUP=1 to load them in the background at startup
+if os.getenv("MODEL_WARMUP") == "1":
+    warm_up((ZERO_SHOT,))
+
 # Global state storage in server
 class ServerState:
     def __init__(self):
@@ -219,6 +230,16 @@ async def get_latest_emails():
         server_state.update_emails(result["emails"])
     return result
 
+@mcp.tool()
+async def list_emails(count: int = 20):
+    """From/Subject/Date of the latest emails; bodies are not downloaded"""
+    return await email_agent.list_emails(count)
+
+@mcp.tool()
+async def get_email_body(uid: int):
+    """Text body of a single email, fetched only when it is needed"""
+    return await email_agent.fetch_email_body(uid)
+
 @mcp.tool()
 async def handle_email_task(task: str) -> dict:
     return await email_agent.handle_task(task)
@@ -240,7 +261,17 @@ async def summarize(body: str) -> str:
 
 @mcp.tool()
 async def send_emails(subject: str, to: str, body: str):
-    return await email_agent.send_emails(subject, to, body)
+    """Queue an email for delivery and return its outbox id; poll get_email_status with it"""
+    outbox_id = await email_agent.queue_email(db_conn, subject, to, body)
+    return {"status": "queued", "id": outbox_id}
+
+@mcp.tool()
+async def get_email_status(message_id: int):
+    """Delivery status of a queued email: queued, sending, sent or failed"""
+    item = get_outbox(db_conn, message_id)
+    if item is None:
+        return {"error": f"No outbox email with id {message_id}"}
+    return {key: item[key] for key in ("id", "status", "attempts", "last_error", "recipient", "subject")}
 
 @mcp.tool()
 async def send_mail_by_Groq(prompt: str) -> str:
@@ -386,7 +417,17 @@ async def chat_about_data(question: str) -> str:
     
     return await bot.query_llm(question, system_prompt)
 
-app = mcp.streamable_http_app
+@asynccontextmanager
+async def lifespan(app):
+    # FastMCP's own lifespan runs once per client session, so the outbox starts with the HTTP app.
+    # Mail a previous run left queued or mid-send goes out as soon as the server is up,
+    # not when someone next calls send_emails or get_email_status
+    async with mcp.session_manager.run():
+        email_agent.start_outbox(db_conn)
+        yield
+
+app = mcp.streamable_http_app()
+app.router.lifespan_context = lifespan
 
 if __name__ == "__main__":
     print("Starting MCP server on http://127.0.0.1:8001")
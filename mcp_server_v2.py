@@ -1,18 +1,34 @@
 from mcp.server.fastmcp import FastMCP
+import asyncio
 import json
+import os
 import sqlite3
 import sqlite_vec
-from db import init_db
+from db import init_db, get_sync_state, get_sync_states, set_sync_state, to_epoch, sender_key
 from embed import get_embedding
+from models import warm_up, MINILM
 from agents.LLMchatbot import LLMChatBot
 from ingest import ingest_emails, ingest_telegram
+from vector_store import open_vector_store, check_filters
 from agents.email_agent import EmailAgent
 from agents.telegram_agent import TelegramAgent
 
 mcp = FastMCP("Email & Telegram Agent V2")
 bot = LLMChatBot()
 
-db_conn, c = init_db("data.db")
+# Ingest runs on worker threads so tool calls keep being served during a sync.
+# The connection is shared with the event loop, and a transaction belongs to the connection, not the
+# thread: a commit from anywhere would commit a half-written ingest batch. So every write, sync
+# watermarks included, happens while holding ingest_lock.
+db_conn, c = init_db("data.db", check_same_thread=False)
+ingest_lock = asyncio.Lock()
+
+# vec0 by default; VECTOR_BACKEND=faiss answers semantic_search from an HNSW index for large archives
+vector_store = open_vector_store("data.db")
+
+# Models load lazily on first use; set MODEL_WARMUP=1 to load them in the background at startup
+if os.getenv("MODEL_WARMUP") == "1":
+    warm_up((MINILM,))
 
 @mcp.tool()
 async def exact_search(sql_query: str) -> str:
@@ -24,41 +40,180 @@ async def exact_search(sql_query: str) -> str:
     except Exception as e:
         return json.dumps({"error": str(e)})
 
-@mcp.tool()
-async def semantic_search(search_text: str, sql_filter: str = "", limit: int = 5) -> str:
-    vector = get_embedding(search_text)
+def fts_quote(text, joiner=" "):
+    """Each term as a quoted phrase, so ids like INV-2024-001 match literally instead of being read as FTS5 syntax."""
+    return joiner.join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+def metadata_filters(source="", sender="", since="", until=""):
+    """
+    SQL appended to a WHERE on metadata aliased m, plus its parameters. since/until are dates or datetimes.
+    sender matches as in vector_filters (email address or chat name), so hybrid search filters both sides alike.
+    """
+    clauses, params = [], []
+    if source:
+        clauses.append("m.source = ?")
+        params.append(source)
+    if sender:
+        clauses.append("sender_key(m.sender) = ?")
+        params.append(sender_key(sender))
+    if since:
+        clauses.append("m.ts >= ?")
+        params.append(to_epoch(since, strict=True))
+    if until:
+        clauses.append("m.ts < ?")
+        params.append(to_epoch(until, strict=True))
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+KEYWORD_QUERY = """
+    SELECT m.id, m.source, m.sender, m.timestamp, m.subject,
+           snippet(metadata_fts, -1, '[', ']', '...', 16), bm25(metadata_fts, 1.0, 2.0, 0.5) AS score
+    FROM metadata_fts
+    JOIN metadata m ON m.rowid = metadata_fts.rowid
+    WHERE metadata_fts MATCH ?{filters}
+    ORDER BY score
+    LIMIT ?
+"""
+
+def keyword_rows(query, filters="", params=(), limit=10):
     cursor = db_conn.cursor()
+    sql = KEYWORD_QUERY.format(filters=filters)
+    try:
+        cursor.execute(sql, (query, *params, limit))
+    except sqlite3.OperationalError:
+        # Not valid FTS5 syntax (stray quotes, dashes, colons): match the terms literally
+        cursor.execute(sql, (fts_quote(query), *params, limit))
+    return cursor.fetchall()
+
+@mcp.tool()
+async def keyword_search(query: str, source: str = "", sender: str = "", since: str = "", until: str = "", limit: int = 10) -> str:
+    """
+    Full-text search for literal terms (order numbers, names, codes), ranked by BM25.
+    query takes FTS5 syntax (AND/OR/NOT, "phrases", prefix*); other text is matched term by term.
+    Filters: source ('email'/'telegram'), sender (email address or Telegram chat name), since/until (dates, until exclusive).
+    """
+    try:
+        filters, params = metadata_filters(source, sender, since, until)
+        rows = await asyncio.to_thread(keyword_rows, query, filters, params, limit)
+    except Exception as e:
+        return json.dumps({"error": str(e)})
     
-    query = """
-        SELECT m.source, m.sender, m.timestamp, m.content, v.distance 
-        FROM vectors v
-        JOIN metadata m ON v.id = m.id
-        WHERE v.embedding MATCH ? AND k = ?
+    keys = ("id", "source", "sender", "timestamp", "subject", "snippet", "bm25")
+    return json.dumps([dict(zip(keys, row)) for row in rows])
+
+# Reciprocal rank fusion constant; 60 is the value from the original RRF paper and rarely needs tuning
+RRF_K = 60
+# Each side of a hybrid search contributes this many candidates per requested result
+HYBRID_DEPTH = 4
+
+def vector_rows(vector, filters=None, limit=5):
+    hits = vector_store.search(db_conn, vector, limit, filters)
+    if not hits:
+        return []
+    
+    cursor = db_conn.cursor()
+    cursor.execute(
+        f"SELECT id, source, sender, timestamp, content FROM metadata WHERE id IN ({','.join('?' * len(hits))})",
+        [msg_id for msg_id, _ in hits]
+    )
+    details = {row[0]: row[1:] for row in cursor.fetchall()}
+    return [(*details[msg_id], distance, msg_id) for msg_id, distance in hits if msg_id in details]
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """rankings: {name: [id, ...] best first}. Returns [(id, score)] best first, score = sum of 1 / (k + rank)."""
+    scores = {}
+    for ids in rankings.values():
+        for rank, msg_id in enumerate(ids, start=1):
+            scores[msg_id] = scores.get(msg_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+async def hybrid_search(search_text, filters=None, limit=5):
+    """
+    Vector KNN and BM25 keyword search run side by side (embedding the query overlaps the FTS lookup)
+    and are merged with reciprocal rank fusion, so exact ids and paraphrases both surface.
     """
+    depth = limit * HYBRID_DEPTH
+    filters = filters or {}
+    # Checked up front so a bad key fails the same way in both modes
+    check_filters(filters)
+    keyword_where, keyword_params = metadata_filters(**filters)
     
-    if sql_filter:
-        query += f" AND {sql_filter}"
-        
-    query += " ORDER BY v.distance"
+    def vector_side():
+        return vector_rows(get_embedding(search_text), filters, depth)
+    
+    def keyword_side():
+        # Any term may match; BM25 puts messages sharing more (and rarer) terms first.
+        # Requiring every word of a natural-language question would usually match nothing.
+        query = fts_quote(search_text, " OR ")
+        return keyword_rows(query, keyword_where, keyword_params, depth) if query else []
+    
+    vector_hits, keyword_hits = await asyncio.gather(
+        asyncio.to_thread(vector_side),
+        asyncio.to_thread(keyword_side)
+    )
+    
+    vector_ranks = {row[5]: (rank, row[4]) for rank, row in enumerate(vector_hits, start=1)}
+    keyword_ranks = {row[0]: (rank, row[6]) for rank, row in enumerate(keyword_hits, start=1)}
+    fused = reciprocal_rank_fusion({
+        "vector": [row[5] for row in vector_hits],
+        "keyword": [row[0] for row in keyword_hits]
+    })[:limit]
     
+    ids = [msg_id for msg_id, _ in fused]
+    cursor = db_conn.cursor()
+    cursor.execute(
+        f"SELECT id, source, sender, timestamp, content FROM metadata WHERE id IN ({','.join('?' * len(ids))})",
+        ids
+    )
+    details = {row[0]: row[1:] for row in cursor.fetchall()}
+    
+    results = []
+    for msg_id, score in fused:
+        source, sender, timestamp, content = details[msg_id]
+        vector_rank, distance = vector_ranks.get(msg_id, (None, None))
+        keyword_rank, bm25 = keyword_ranks.get(msg_id, (None, None))
+        results.append({
+            "id": msg_id, "source": source, "sender": sender, "timestamp": timestamp, "content": content,
+            "rrf_score": score,
+            "vector_rank": vector_rank, "distance": distance,
+            "keyword_rank": keyword_rank, "bm25": bm25
+        })
+    return results
+
+@mcp.tool()
+async def semantic_search(search_text: str, filters: dict | None = None, limit: int = 5, hybrid: bool = False) -> str:
+    """
+    Search by meaning with a vector KNN. filters narrow the search inside the index, e.g.
+    {"source": "telegram", "sender": "alice@example.com", "since": "2026-01-01", "until": "2026-02-01"}
+    (sender is an email address or Telegram chat name; until is exclusive).
+    With hybrid=True the BM25 keyword search runs too and both rankings are fused, which also finds
+    exact tokens such as invoice ids; each result then carries its rrf_score plus the rank, distance
+    and bm25 it got from each side.
+    """
     try:
-        cursor.execute(query, (json.dumps(vector), limit))
-        rows = cursor.fetchall()
-        return json.dumps(rows)
+        if hybrid:
+            return json.dumps(await hybrid_search(search_text, filters, limit))
+        
+        vector = await asyncio.to_thread(get_embedding, search_text)
+        rows = await asyncio.to_thread(vector_rows, vector, filters, limit)
+        return json.dumps([row[:5] for row in rows])
         
     except Exception as e:
         return json.dumps({"error": str(e)})
-    
+
 @mcp.tool()
 async def chat_about_data(q: str) -> str:
     p = """
     Database Schema:
     Table: metadata
-    Columns: id, source, sender, timestamp, is_read, content
+    Columns: id, source ('email' or 'telegram'), sender, timestamp (original date text), ts (Unix epoch seconds), is_read, content, subject
+    Use ts, not timestamp, for date ranges and ordering, e.g. ts >= strftime('%s', 'now', '-7 days').
+    Indexed: (source, ts), (sender, ts), (is_read, ts).
     
     Tools Available:
     1. exact_search(sql_query): For math, dates, counts, exact names.
-    2. semantic_search(search_text, sql_filter): For meaning, sentiment, topics.
+    2. semantic_search(search_text, filters, hybrid): For meaning, sentiment, topics. filters is a dict with
+       any of source, sender, since, until. hybrid=True also matches exact words and ids, so one call covers both.
+    3. keyword_search(query, source, sender, since, until): For literal words, names, codes and ids.
     
     Determine the best tool for the question, execute it, read the returned data, and answer the user directly.
     """
@@ -69,20 +224,94 @@ async def chat_about_data(q: str) -> str:
 email_agent = EmailAgent()
 telegram_agent = TelegramAgent()
 
+async def ingest_emails_locked(emails, watermark=None):
+    """watermark: (folder, uidvalidity, last_uid), saved once the rows are committed."""
+    async with ingest_lock:
+        stats = await asyncio.to_thread(ingest_emails, db_conn, emails)
+        await asyncio.to_thread(vector_store.add, db_conn, stats["ids"])
+        if watermark:
+            set_sync_state(db_conn, "email", *watermark)
+    return stats
+
+async def sync_email_folder(folder: str = "inbox"):
+    # Only mail newer than the stored UID watermark is fetched
+    uidvalidity, last_uid = get_sync_state(db_conn, "email", folder)
+    result = await email_agent.sync_emails(last_uid, uidvalidity, folder) # result = 'emails' : [{from : str , 'subject' : str, 'body' : str, 'unread' : {True / False}], 'uidvalidity', 'last_uid'
+    
+    stats = await ingest_emails_locked(result["emails"], (folder, result["uidvalidity"], result["last_uid"]))
+    return result, stats
+
 @mcp.tool()
-async def get_latest_emails():
-    result = await email_agent.fetch_latest_emails() # result = 'emails' : [{from : str , 'subject' : str, 'body' : str, 'unread' : {True / False}]
+async def get_latest_emails(folder: str = "inbox"):
+    result, stats = await sync_email_folder(folder)
+        
+    return json.dumps({"status": "success", "count": len(result["emails"]), "skipped": stats.get("skipped", 0), "last_uid": result["last_uid"]})
+
+@mcp.tool()
+async def backfill_emails(folder: str = "inbox"):
+    """Ingest every message in a folder. Parsing runs across all cores and streams into ingest batch by batch."""
+    loop = asyncio.get_running_loop()
+    
+    def on_batch(emails):
+        # Called on the IMAP worker thread; waiting here keeps parsing from running ahead of ingest
+        asyncio.run_coroutine_threadsafe(ingest_emails_locked(emails), loop).result()
+    
+    total = await email_agent.backfill_emails(on_batch, folder)
+    return json.dumps({"status": "success", "folder": folder, "count": total})
+
+@mcp.tool()
+async def watch_emails(folder: str = "inbox"):
+    """Keep an IMAP IDLE connection open and ingest new mail as soon as the server announces it."""
+    loop = asyncio.get_running_loop()
     
-    if "emails" in result:
-        ingest_emails(db_conn, result["emails"])
+    def on_new_mail():
+        # Called on the watcher thread; the sync itself runs on the server's event loop
+        future = asyncio.run_coroutine_threadsafe(sync_email_folder(folder), loop)
+        result, _ = future.result()
+        if result["emails"]:
+            print(f"Ingested {len(result['emails'])} new emails from {folder}")
+    
+    email_agent.start_watching(on_new_mail, folder)
+    return json.dumps({"status": "watching", "folder": folder})
+
+async def ingest_telegram_locked(chats, last_ids):
+    async with ingest_lock:
+        stats = await asyncio.to_thread(ingest_telegram, db_conn, chats)
+        await asyncio.to_thread(vector_store.add, db_conn, stats["ids"])
         
-    return json.dumps({"status": "success", "count": len(result.get("emails", []))})
+        # Watermarks move only after the rows are committed, and never backwards
+        for chat_id, last_id in last_ids.items():
+            _, stored = get_sync_state(db_conn, "telegram", str(chat_id))
+            if last_id > stored:
+                set_sync_state(db_conn, "telegram", str(chat_id), None, last_id)
+    return stats
 
 @mcp.tool()
-async def get_telegram_messages():
-    msgs = await telegram_agent.fetch_messages()
+async def get_telegram_messages(chat_limit: int = 0, per_chat: int = 0):
+    """
+    Sync new messages from the top chat_limit chats (0 uses the TELEGRAM_CHAT_LIMIT / TELEGRAM_PER_CHAT
+    settings). Only messages above each chat's stored watermark are fetched; a chat's first sync takes per_chat.
+    """
+    watermarks = {int(scope): last_id for scope, (_, last_id) in get_sync_states(db_conn, "telegram").items()}
+    result = await telegram_agent.sync_messages(watermarks, chat_limit, per_chat)
+    stats = await ingest_telegram_locked(result["chats"], result["last_ids"])
     
-    ingest_telegram(db_conn, msgs)
+    return json.dumps({
+        "status": "success",
+        "chats_synced": len(result["last_ids"]),
+        "count": stats.get("rows", 0),
+        "skipped": stats.get("skipped", 0)
+    })
+
+@mcp.tool()
+async def watch_telegram():
+    """Ingest new and edited Telegram messages as they arrive, so search stays fresh without polling."""
+    async def on_batch(chats, last_ids):
+        stats = await ingest_telegram_locked(chats, last_ids)
+        print(f"Ingested {stats.get('rows', 0)} live telegram messages")
     
-    return json.dumps({"status": "success", "chats_synced": len(msgs.keys())})
+    # Listen first, then catch up on anything sent while nobody was; overlaps dedupe on message id
+    await telegram_agent.start_watching(on_batch)
+    await get_telegram_messages()
+    return json.dumps({"status": "watching"})
 
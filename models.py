@@ -0,0 +1,61 @@
+import threading
+
+MINILM = "all-MiniLM-L6-v2"
+ZERO_SHOT = "knowledgator/comprehend_it-base"
+
+_models = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+def _load_sentence_transformer(name):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+def _load_zero_shot(name):
+    from transformers import pipeline
+    return pipeline("zero-shot-classification", model=name)
+
+_LOADERS = {
+    MINILM: _load_sentence_transformer,
+    ZERO_SHOT: _load_zero_shot,
+}
+
+def get_model(name):
+    """Return the shared instance of a registered model, loading it on first use."""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    
+    if name not in _LOADERS:
+        raise KeyError(f"Unknown model: {name}")
+    
+    with _registry_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    
+    # One lock per model so a slow load doesn't block the others.
+    with lock:
+        if name not in _models:
+            print(f"Loading model {name}...")
+            _models[name] = _LOADERS[name](name)
+            print(f"Model {name} ready.")
+    return _models[name]
+
+def is_loaded(name):
+    return name in _models
+
+def warm_up(names=(MINILM, ZERO_SHOT), background=True):
+    """Load the given models now; with background=True this returns immediately."""
+    def _load_all():
+        for name in names:
+            try:
+                get_model(name)
+            except Exception as e:
+                print(f"Model warm-up failed for {name}: {e}")
+    
+    if not background:
+        _load_all()
+        return None
+    
+    thread = threading.Thread(target=_load_all, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -1,42 +1,423 @@
 import imaplib
+import binascii
+import quopri
 from email import message_from_bytes
+from html import unescape
+from html.parser import HTMLParser
 from email.header import decode_header
-from typing import List, Dict, Optional
-from bs4 import BeautifulSoup
+from typing import Any, Callable, Iterable, Iterator, List, Dict, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
 import re
 from email.utils import parsedate_to_datetime
 
+# Messages requested per UID FETCH round trip
+FETCH_WINDOW = 50
+
+# Messages handed to a worker process per task when parsing in parallel
+PARSE_CHUNK = 64
+
+# Parse workers are started from a clean server process rather than forked from the threaded caller,
+# which could hand them a lock some other thread (asyncio, IMAP, torch) was holding at the time
+PARSE_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Socket timeout for IMAP commands, so a stalled server can't hang a worker forever
+IMAP_TIMEOUT = 60
+
+# Enough to list a message without downloading its body or attachments
+HEADER_FIELDS = "FROM SUBJECT DATE MESSAGE-ID"
+HEADER_FETCH = f"(UID FLAGS BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})] BODYSTRUCTURE)"
+
+_LITERAL_MARKER = re.compile(rb"\{\d+\}$")
+
+# Body text kept per message; long marketing mails are cut here
+MAX_BODY_CHARS = 20_000
+# Raw HTML fed to the parser per chunk; parsing stops once MAX_BODY_CHARS of text are collected
+HTML_FEED_CHUNK = 16_384
+
+_MARKUP = re.compile(r"<[a-zA-Z!/?]")
+_INVISIBLE = re.compile(r'[\u200b\u200c\u200d\u2007\u2060\ufeff\u00a0]+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class _TextExtractor(HTMLParser):
+    """
+    Streams text out of HTML without building a tree, skipping script and style contents.
+    Text nodes are separated by a space at each tag, as get_text(separator=" ") did; text that
+    HTMLParser hands over in pieces (it flushes at the end of every fed chunk) is joined as is.
+    """
+
+    SKIP_TAGS = {"script", "style", "noscript", "template"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.size = 0
+        self._skip_depth = 0
+
+    def _separate(self):
+        if self.parts and self.parts[-1] != " ":
+            self.parts.append(" ")
+
+    def handle_starttag(self, tag, attrs):
+        self._separate()
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        self._separate()
+        if tag in self.SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_comment(self, data):
+        self._separate()
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+            self.size += len(data)
+
+
+def _clean_text(text: str, max_chars: int) -> str:
+    # Remove invisible characters
+    text = _INVISIBLE.sub(' ', text)
+
+    # Normalize whitespace
+    text = _WHITESPACE.sub(' ', text).strip()
+
+    return text[:max_chars]
+
+
+def html_to_text(html: str, max_chars: int = MAX_BODY_CHARS, is_html: bool = True) -> str:
+    """
+    Visible text of an email body. Bodies without markup skip parsing entirely (entities are
+    still decoded when the part is text/html); real HTML is streamed through HTMLParser until
+    max_chars of text have been seen.
+    """
+    if not html:
+        return ""
+
+    if not _MARKUP.search(html):
+        return _clean_text(unescape(html) if is_html else html, max_chars)
+
+    parser = _TextExtractor()
+    for start in range(0, len(html), HTML_FEED_CHUNK):
+        parser.feed(html[start:start + HTML_FEED_CHUNK])
+        # Whitespace collapses later, so collect some slack beyond the cap
+        if parser.size > max_chars * 2:
+            break
+    else:
+        parser.close()
+
+    return _clean_text("".join(parser.parts), max_chars)
+
+
+class _Literal(bytes):
+    """Raw literal payload inside a tokenized FETCH response."""
+
+
+def _tokenize(data: bytes, tokens: List[Any]) -> None:
+    i, n = 0, len(data)
+    while i < n:
+        ch = data[i:i + 1]
+        if ch in b" \r\n":
+            i += 1
+        elif ch in b"()":
+            tokens.append(ch.decode())
+            i += 1
+        elif ch == b'"':
+            i += 1
+            out = bytearray()
+            while i < n and data[i:i + 1] != b'"':
+                if data[i:i + 1] == b"\\":
+                    i += 1
+                out += data[i:i + 1]
+                i += 1
+            tokens.append(bytes(out))
+            i += 1
+        else:
+            # atoms may carry a bracketed section, e.g. BODY[HEADER.FIELDS (FROM DATE)]
+            start, depth = i, 0
+            while i < n:
+                ch = data[i:i + 1]
+                if ch == b"[":
+                    depth += 1
+                elif ch == b"]":
+                    depth -= 1
+                elif depth == 0 and ch in b" ()\r\n":
+                    break
+                i += 1
+            atom = data[start:i].decode("ascii", errors="replace")
+            tokens.append(None if atom.upper() == "NIL" else atom)
+
+
+def _parse_tokens(tokens: List[Any], pos: int):
+    items = []
+    while pos < len(tokens):
+        token = tokens[pos]
+        if token == "(":
+            value, pos = _parse_tokens(tokens, pos + 1)
+            items.append(value)
+        elif token == ")":
+            return items, pos + 1
+        else:
+            items.append(token)
+            pos += 1
+    return items, pos
+
+
+def parse_fetch_response(data: Iterable[Any]) -> List[Dict[str, Any]]:
+    """
+    Turn imaplib's FETCH data (bytes lines and (prefix, literal) tuples) into one dict per message,
+    keyed by the upper-cased item name, plus "SEQ" for the message sequence number.
+    """
+    tokens: List[Any] = []
+    for part in data:
+        if isinstance(part, tuple):
+            _tokenize(_LITERAL_MARKER.sub(b"", part[0]), tokens)
+            tokens.append(_Literal(part[1]))
+        elif isinstance(part, bytes):
+            _tokenize(part, tokens)
+
+    parsed, _ = _parse_tokens(tokens, 0)
+    messages = []
+    for seq, items in zip(parsed, parsed[1:]):
+        if not (isinstance(seq, str) and seq.isdigit() and isinstance(items, list)):
+            continue
+        message: Dict[str, Any] = {"SEQ": int(seq)}
+        for key, value in zip(items[::2], items[1::2]):
+            if isinstance(key, str):
+                message[key.upper()] = int(value) if key.upper() == "UID" else value
+        messages.append(message)
+    return messages
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="ignore").lower()
+    return (value or "").lower()
+
+
+def _walk_bodystructure(structure: List[Any], section: str):
+    """Yield (section, single-part structure) for every leaf of a BODYSTRUCTURE."""
+    if structure and isinstance(structure[0], list):
+        # Multipart: child parts come first, then the multipart subtype and extension data
+        index = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            yield from _walk_bodystructure(child, f"{section}.{index}" if section else str(index))
+    else:
+        yield section or "1", structure
+
+
+def find_text_part(structure: List[Any]) -> Optional[Dict[str, str]]:
+    """
+    Pick the body part worth downloading from a BODYSTRUCTURE: the first inline text/plain part,
+    else the first inline text/html part. Returns its section number, subtype, encoding and charset.
+    """
+    best = None
+    for section, part in _walk_bodystructure(structure, ""):
+        if len(part) < 7 or _text(part[0]) != "text":
+            continue
+
+        subtype = _text(part[1])
+        if subtype not in ("plain", "html"):
+            continue
+
+        # Disposition sits among the extension fields, e.g. ("attachment" ("filename" "a.txt"))
+        if any(isinstance(ext, list) and ext and _text(ext[0]) == "attachment" for ext in part[7:]):
+            continue
+
+        params = part[2] if isinstance(part[2], list) else []
+        charset = dict(zip(map(_text, params[::2]), map(_text, params[1::2]))).get("charset", "utf-8")
+        candidate = {"section": section, "subtype": subtype, "encoding": _text(part[5]) or "7bit", "charset": charset}
+
+        if subtype == "plain":
+            return candidate
+        best = best or candidate
+    return best
+
+
+def decode_part(payload: bytes, encoding: str, charset: str) -> str:
+    if encoding == "base64":
+        payload = binascii.a2b_base64(payload)
+    elif encoding == "quoted-printable":
+        payload = quopri.decodestring(payload)
+
+    try:
+        return payload.decode(charset or "utf-8", errors="ignore")
+    except LookupError:
+        return payload.decode("utf-8", errors="ignore")
+
+
+def parse_headers(msg) -> Dict[str, str]:
+    #Handing Date
+    date_raw = msg.get("Date")
+    date = None
+    if date_raw:
+        try:
+            date = parsedate_to_datetime(date_raw).isoformat()
+        except (TypeError, ValueError) as e:
+            print(f"Debug: Unparseable Date header {date_raw!r}: {e}")
+
+    # Handle subject more safely
+    subject = "(No Subject)"
+    if msg["Subject"]:
+        try:
+            subject_parts = decode_header(msg["Subject"])
+            if subject_parts:
+                subject_raw, encoding = subject_parts[0]
+                subject = (
+                    subject_raw.decode(encoding or "utf-8")
+                    if isinstance(subject_raw, bytes)
+                    else subject_raw or "(No Subject)"
+                )
+        except Exception as e:
+            print(f"Debug: Subject decode error: {e}")
+            subject = str(msg["Subject"])[:100]  # Truncate if too long
+
+    return {
+        "from": msg.get("From", "(Unknown Sender)"),
+        "subject": subject,
+        "date" : date,
+        "message_id" : (msg.get("Message-ID") or "").strip()
+    }
+
+
+def parse_email_bytes(raw: bytes) -> Dict[str, str]:
+    """Headers and visible body text of one RFC 822 message. Pure, so it can run in a worker process."""
+    msg = message_from_bytes(raw)
+    body = ""
+    is_html = False
+
+    if msg.is_multipart():
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            content_dispo = str(part.get("Content-Disposition"))
+
+            if content_type == "text/plain" and "attachment" not in content_dispo:
+                payload = part.get_payload(decode=True)
+                if isinstance(payload, bytes):
+                    body = payload.decode("utf-8", errors="ignore").strip()
+                    is_html = False
+                break  # prefer plain text, stop after first match
+
+            elif content_type == "text/html" and not body:
+                payload = part.get_payload(decode=True)
+                if isinstance(payload, bytes):
+                    body = payload.decode("utf-8", errors="ignore").strip()
+                    is_html = True
+
+    else:
+        payload = msg.get_payload(decode=True)
+        if isinstance(payload, bytes):
+            body = payload.decode("utf-8", errors="ignore")
+            is_html = msg.get_content_type() == "text/html"
+
+    email_data = parse_headers(msg)
+    email_data["body"] = html_to_text(body, is_html=is_html)
+    return email_data
+
+
+def _parse_chunk(raws: List[bytes]) -> List[Optional[Dict[str, str]]]:
+    results = []
+    for raw in raws:
+        try:
+            results.append(parse_email_bytes(raw))
+        except Exception as e:
+            print(f"Debug: Failed to parse email: {e}")
+            results.append(None)
+    return results
+
+
+def parse_emails(raws: Iterable[bytes], workers: Optional[int] = None, chunk_size: int = PARSE_CHUNK) -> Iterator[Optional[Dict[str, str]]]:
+    """
+    Parse raw messages on a process pool, yielding results in input order as they finish
+    (None for a message that failed to parse). Only a few chunks per worker are in flight
+    at once, so a 50k-message backfill never sits in memory all at once.
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(PARSE_START_METHOD)) as pool:
+        pending = deque()
+        chunk: List[bytes] = []
+        for raw in raws:
+            chunk.append(raw)
+            if len(chunk) < chunk_size:
+                continue
+            pending.append(pool.submit(_parse_chunk, chunk))
+            chunk = []
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+
+        if chunk:
+            pending.append(pool.submit(_parse_chunk, chunk))
+        while pending:
+            yield from pending.popleft().result()
+
+
+def uid_set(uids: Iterable[int]) -> str:
+    """Compress UIDs into an IMAP sequence set, e.g. [1, 2, 3, 7] -> "1:3,7"."""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+
 class EmailFetchAgent:
-    def __init__(self, email_address: str, app_password: str, imap_server: str = "imap.gmail.com"):
+    def __init__(self, email_address: str, app_password: str, imap_server: str = "imap.gmail.com",
+                 fetch_window: int = FETCH_WINDOW, imap_factory: Callable[..., imaplib.IMAP4] = imaplib.IMAP4_SSL,
+                 timeout: Optional[float] = IMAP_TIMEOUT):
         self.email_address = email_address
         self.app_password = app_password
         self.imap_server = imap_server
-        self.connection: Optional[imaplib.IMAP4_SSL] = None
-        
-    def strip_html_tags(self,html):
-        """
-        Simpler version with basic cleaning
-        """
-        soup = BeautifulSoup(html, "html.parser")
-        
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-        
-        text = soup.get_text(separator=" ", strip=True)
-        
-        # Remove invisible characters
-        text = re.sub(r'[\u200b\u200c\u200d\u2007\u2060\ufeff\u00a0]+', ' ', text)
+        self.fetch_window = fetch_window
+        self.timeout = timeout
+        # Swap in imaplib.IMAP4 (or a stand-in) to talk to a local test server
+        self.imap_factory = imap_factory
+        self.connection: Optional[imaplib.IMAP4] = None
+        self.folder = "inbox"
+        self.uidvalidity: Optional[int] = None
         
-        # Normalize whitespace
-        text = re.sub(r'\s+', ' ', text)
-        
-        return text.strip()
+    def strip_html_tags(self,html, is_html: bool = True):
+        return html_to_text(html, is_html=is_html)
 
-    def connect(self) -> None:
-        self.connection = imaplib.IMAP4_SSL(self.imap_server)
+    def connect(self, folder: str = "inbox") -> None:
+        self.connection = self.imap_factory(self.imap_server, timeout=self.timeout)
         self.connection.login(self.email_address, self.app_password)
-        self.connection.select('inbox')
+        self.select(folder)
+
+    def select(self, folder: str) -> None:
+        assert self.connection is not None, "IMAP connection not established"
+
+        self.connection.select(folder)
+        self.folder = folder
+
+        # The SELECT reply carries UIDVALIDITY; keep it, since response() can only be read once
+        _, data = self.connection.response("UIDVALIDITY")
+        self.uidvalidity = int(data[0]) if data and data[0] is not None else None
+
+    def get_uidvalidity(self) -> Optional[int]:
+        """UIDVALIDITY of the selected folder; UIDs are only comparable while it stays the same."""
+        assert self.connection is not None, "IMAP connection not established"
+
+        if self.uidvalidity is None:
+            _, data = self.connection.status(self.folder, "(UIDVALIDITY)")
+            match = re.search(rb"UIDVALIDITY (\d+)", data[0] or b"")
+            self.uidvalidity = int(match.group(1)) if match else None
+        return self.uidvalidity
+
+    def parse_headers(self, msg) -> Dict[str, str]:
+        return parse_headers(msg)
+
+    def parse_email(self, raw: bytes) -> Dict[str, str]:
+        return parse_email_bytes(raw)
 
     def fetch_latest_emails(self) -> List[Dict[str, str]]:
         assert self.connection is not None, "IMAP connection not established"
@@ -51,76 +432,216 @@ class EmailFetchAgent:
 
         results = []
 
-        for i, num in enumerate(latest_ids):
-            try:
-                status, data = self.connection.fetch(num.decode(), "(RFC822)")
-                
-                for response in data:
-                    if isinstance(response, tuple):
-                        msg = message_from_bytes(response[1])
-
-                        #Handing Date
-                        date_raw = msg.get("Date")
-                        date = parsedate_to_datetime(date_raw).isoformat() if date_raw else None
-
-                        # Handle subject more safely
-                        subject = "(No Subject)"
-                        if msg["Subject"]:
-                            try:
-                                subject_parts = decode_header(msg["Subject"])
-                                if subject_parts:
-                                    subject_raw, encoding = subject_parts[0]
-                                    subject = (
-                                        subject_raw.decode(encoding or "utf-8")
-                                        if isinstance(subject_raw, bytes)
-                                        else subject_raw or "(No Subject)"
-                                    )
-                            except Exception as e:
-                                print(f"Debug: Subject decode error: {e}")
-                                subject = str(msg["Subject"])[:100]  # Truncate if too long
-
-                        from_ = msg.get("From", "(Unknown Sender)")
-                        body = ""
-
-                        if msg.is_multipart():
-                            for part in msg.walk():
-                                content_type = part.get_content_type()
-                                content_dispo = str(part.get("Content-Disposition"))
-
-                                if content_type == "text/plain" and "attachment" not in content_dispo:
-                                    payload = part.get_payload(decode=True)
-                                    if isinstance(payload, bytes):
-                                        body = payload.decode("utf-8", errors="ignore").strip()
-                                    break  # prefer plain text, stop after first match
-
-                                elif content_type == "text/html" and not body:
-                                    payload = part.get_payload(decode=True)
-                                    if isinstance(payload, bytes):
-                                        body = payload.decode("utf-8", errors="ignore").strip()
-
-                        else:
-                            payload = msg.get_payload(decode=True)
-                            if isinstance(payload, bytes):
-                                body = payload.decode("utf-8", errors="ignore")
-
-                        is_unread = num in unread_id_list
-                        body = self.strip_html_tags(body)
-
-                        results.append({
-                            "from": from_,
-                            "subject": subject,
-                            "body": body,
-                            "unread": is_unread,
-                            "date" : date
-                        })
-                        
-            except Exception as e:
-                print(f"Debug: Failed to process email {num.decode()}: {e}")
+        if latest_ids:
+            status, data = self.connection.fetch(b",".join(latest_ids).decode(), "(RFC822)")
+
+            for message in parse_fetch_response(data):
+                num = str(message["SEQ"]).encode()
+                try:
+                    email_data = self.parse_email(message["RFC822"])
+                    email_data["unread"] = num in unread_id_list
+                    results.append(email_data)
+                except Exception as e:
+                    print(f"Debug: Failed to process email {num.decode()}: {e}")
 
         print(f"Debug: Successfully processed {len(results)} out of {len(latest_ids)} emails")
         return results
 
+    def fetch_raw_emails(self, uids: List[int], window: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yield {"uid", "raw", "unread"} for the given UIDs, one UID FETCH per `window` messages
+        instead of a round trip per message. BODY.PEEK[] leaves the \\Seen flag alone.
+        """
+        assert self.connection is not None, "IMAP connection not established"
+
+        window = window or self.fetch_window
+        for start in range(0, len(uids), window):
+            chunk = uids[start:start + window]
+            status, data = self.connection.uid("FETCH", uid_set(chunk), "(UID FLAGS BODY.PEEK[])")
+            if status != "OK":
+                print(f"Debug: UID FETCH failed for {uid_set(chunk)}: {status}")
+                continue
+
+            for message in parse_fetch_response(data):
+                if "UID" in message and message.get("BODY[]") is not None:
+                    yield {
+                        "uid": message["UID"],
+                        "raw": bytes(message["BODY[]"]),
+                        "unread": "\\Seen" not in (message.get("FLAGS") or [])
+                    }
+
+    def backfill_emails(self, uids: Optional[List[int]] = None, workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Stream every message in `uids` (default: the whole folder) as parsed email dicts, in UID order.
+        Downloads stay on this connection while MIME parsing and text extraction run on a process pool.
+        """
+        assert self.connection is not None, "IMAP connection not established"
+
+        if uids is None:
+            status, all_ids = self.connection.uid("SEARCH", None, "ALL")
+            uids = sorted(int(uid) for uid in all_ids[0].split())
+
+        fetched = deque()
+
+        def raws():
+            for item in self.fetch_raw_emails(uids):
+                fetched.append(item)
+                yield item["raw"]
+
+        for email_data in parse_emails(raws(), workers):
+            item = fetched.popleft()
+            if email_data is None:
+                continue
+            email_data["uid"] = item["uid"]
+            email_data["unread"] = item["unread"]
+            email_data["uidvalidity"] = self.uidvalidity
+            yield email_data
+
+    def fetch_headers(self, uids: List[int], window: Optional[int] = None, failed: Optional[set] = None) -> List[Dict[str, Any]]:
+        """
+        List messages from their headers and BODYSTRUCTURE only; no body or attachment bytes are downloaded.
+        Each entry keeps its "structure" so fetch_bodies can later pull just the text part.
+        UIDs of chunks the server refused are added to `failed`, if given.
+        """
+        assert self.connection is not None, "IMAP connection not established"
+
+        window = window or self.fetch_window
+        results = []
+        for start in range(0, len(uids), window):
+            chunk = uids[start:start + window]
+            status, data = self.connection.uid("FETCH", uid_set(chunk), HEADER_FETCH)
+            if status != "OK":
+                print(f"Debug: UID FETCH failed for {uid_set(chunk)}: {status}")
+                if failed is not None:
+                    failed.update(chunk)
+                continue
+
+            for message in parse_fetch_response(data):
+                if "UID" not in message:
+                    continue
+                header_bytes = next(
+                    (bytes(value) for key, value in message.items() if key.startswith("BODY[HEADER.FIELDS") and value),
+                    b""
+                )
+                # One malformed message must not abort the sync, or the watermark never gets past it
+                try:
+                    email_data = self.parse_headers(message_from_bytes(header_bytes))
+                except Exception as e:
+                    print(f"Debug: Failed to parse headers of email {message['UID']}: {e}")
+                    continue
+                email_data["uid"] = message["UID"]
+                email_data["unread"] = "\\Seen" not in (message.get("FLAGS") or [])
+                email_data["structure"] = message.get("BODYSTRUCTURE") or []
+                results.append(email_data)
+        return results
+
+    def fetch_bodies(self, headers: List[Dict[str, Any]], window: Optional[int] = None, failed: Optional[set] = None) -> Dict[int, str]:
+        """
+        Download only the text/plain (or text/html) part of each listed message.
+        Messages whose text part has the same section number are fetched together.
+        UIDs of chunks the server refused are added to `failed`, if given.
+        """
+        assert self.connection is not None, "IMAP connection not established"
+
+        window = window or self.fetch_window
+        by_section: Dict[str, List[int]] = {}
+        parts: Dict[int, Dict[str, str]] = {}
+        for email_data in headers:
+            part = find_text_part(email_data.get("structure") or [])
+            if part:
+                parts[email_data["uid"]] = part
+                by_section.setdefault(part["section"], []).append(email_data["uid"])
+
+        bodies: Dict[int, str] = {}
+        for section, section_uids in by_section.items():
+            for start in range(0, len(section_uids), window):
+                chunk = section_uids[start:start + window]
+                status, data = self.connection.uid("FETCH", uid_set(chunk), f"(UID BODY.PEEK[{section}])")
+                if status != "OK":
+                    print(f"Debug: UID FETCH failed for {uid_set(chunk)}: {status}")
+                    if failed is not None:
+                        failed.update(chunk)
+                    continue
+
+                for message in parse_fetch_response(data):
+                    uid = message.get("UID")
+                    payload = message.get(f"BODY[{section}]")
+                    if uid not in parts or payload is None:
+                        continue
+                    part = parts[uid]
+                    try:
+                        body = decode_part(bytes(payload), part["encoding"], part["charset"]).strip()
+                        bodies[uid] = self.strip_html_tags(body, part["subtype"] == "html")
+                    except Exception as e:
+                        print(f"Debug: Failed to decode body of email {uid}: {e}")
+        return bodies
+
+    def list_latest_emails(self, count: int = 20) -> List[Dict[str, Any]]:
+        """From/Subject/Date of the newest `count` messages, without downloading any bodies."""
+        assert self.connection is not None, "IMAP connection not established"
+
+        status, all_ids = self.connection.uid("SEARCH", None, "ALL")
+        uids = sorted(int(uid) for uid in all_ids[0].split())[-count:]
+
+        headers = self.fetch_headers(uids)
+        for email_data in headers:
+            email_data.pop("structure", None)
+        return headers
+
+    def fetch_body(self, uid: int) -> str:
+        """Body text of a single message, fetched on demand."""
+        headers = self.fetch_headers([uid])
+        return self.fetch_bodies(headers).get(uid, "")
+
+    def fetch_new_emails(self, last_uid: int = 0, uidvalidity: Optional[int] = None, initial_limit: int = 50) -> Dict:
+        """
+        Fetch only messages with UID > last_uid in the selected folder.
+        If the folder's UIDVALIDITY changed the stored watermark is meaningless, so we start over.
+        On a first sync (no watermark) only the newest `initial_limit` messages are taken.
+        """
+        assert self.connection is not None, "IMAP connection not established"
+
+        current_validity = self.get_uidvalidity()
+        if uidvalidity is not None and current_validity != uidvalidity:
+            print(f"Debug: UIDVALIDITY changed ({uidvalidity} -> {current_validity}), resyncing")
+            last_uid = 0
+
+        status, new_ids = self.connection.uid("SEARCH", None, f"UID {last_uid + 1}:*")
+
+        # "n:*" always matches the highest UID, even when it is below n
+        uids = sorted(int(uid) for uid in new_ids[0].split() if int(uid) > last_uid)
+
+        if last_uid == 0 and initial_limit:
+            uids = uids[-initial_limit:]
+
+        # Headers first, then only the text part of each message; attachments are never downloaded
+        results = []
+        failed: set = set()
+        headers = self.fetch_headers(uids, failed=failed)
+        bodies = self.fetch_bodies(headers, failed=failed)
+        for email_data in headers:
+            if email_data["uid"] in failed:
+                continue
+            email_data.pop("structure", None)
+            email_data["body"] = bodies.get(email_data["uid"], "")
+            email_data["uidvalidity"] = current_validity
+            results.append(email_data)
+
+        # The watermark stops below the first UID that failed to download, so the next sync retries it.
+        # Messages past that point are fetched again too; ingest skips the ones it already has.
+        blocked = min(failed, default=None)
+        fetched = [uid for uid in uids if blocked is None or uid < blocked]
+        if failed:
+            print(f"Debug: {len(failed)} emails failed to download, holding the watermark below UID {blocked}")
+
+        print(f"Debug: Synced {len(results)} new emails after UID {last_uid}")
+        return {
+            "emails": results,
+            "uidvalidity": current_validity,
+            "last_uid": max(fetched, default=last_uid)
+        }
 
     def disconnect(self) -> None:
         if self.connection:
-            self.connection.logout()
\ No newline at end of file
+            self.connection.logout()
+            self.connection = None
\ No newline at end of file
@@ -0,0 +1,202 @@
+import imaplib
+import re
+import socket
+import threading
+from concurrent.futures import CancelledError
+from typing import Callable, Optional
+
+from server.getting_mail import EmailFetchAgent
+
+# RFC 2177 asks clients to re-issue IDLE before the server's 30 minute inactivity timeout
+IDLE_TIMEOUT = 25 * 60
+MAX_BACKOFF = 300
+
+_EXISTS = re.compile(rb"^\* \d+ EXISTS")
+
+# What a dropped or half-closed IMAP connection looks like from imaplib
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+class _IdleTimeout(Exception):
+    """An IDLE cycle ran out without news; the watcher starts the next one on a fresh connection."""
+
+
+class ImapSession:
+    """
+    Keeps one logged-in IMAP connection open across tool calls instead of doing
+    TLS + LOGIN + SELECT every time. A dead connection is replaced on the next call.
+    """
+
+    def __init__(self, agent: EmailFetchAgent, folder: str = "inbox"):
+        self.agent = agent
+        self.folder = folder
+        self._lock = threading.Lock()
+        # Cancel event of the call currently using the connection, so abort() only cuts that call
+        self._running: Optional[threading.Event] = None
+
+    def _is_alive(self) -> bool:
+        if self.agent.connection is None:
+            return False
+        try:
+            status, _ = self.agent.connection.noop()
+            return status == "OK"
+        except CONNECTION_ERRORS:
+            return False
+
+    def _reconnect(self, folder: str) -> None:
+        self.close()
+        self.agent.connect(folder)
+
+    def ensure_connected(self, folder: Optional[str] = None) -> None:
+        folder = folder or self.folder
+        if not self._is_alive():
+            self._reconnect(folder)
+        elif self.agent.folder != folder:
+            self.agent.select(folder)
+
+    def run(self, fn: Callable, *args, folder: Optional[str] = None, cancelled: Optional[threading.Event] = None, **kwargs):
+        """
+        Call fn on the shared connection, reconnecting and retrying once if the server dropped it.
+        Once `cancelled` is set (see abort) the call is skipped if still queued and never retried.
+        """
+        with self._lock:
+            if cancelled is not None and cancelled.is_set():
+                raise CancelledError()
+            self._running = cancelled
+            try:
+                self.ensure_connected(folder)
+                try:
+                    return fn(*args, **kwargs)
+                except CONNECTION_ERRORS as e:
+                    if cancelled is not None and cancelled.is_set():
+                        # abort() cut the connection on purpose and nobody is waiting for the result
+                        raise
+                    print(f"Debug: IMAP connection lost ({e}), reconnecting")
+                    self._reconnect(folder or self.folder)
+                    return fn(*args, **kwargs)
+            finally:
+                self._running = None
+
+    def abort(self, cancelled: Optional[threading.Event] = None) -> None:
+        """
+        Give up on a run() call from another thread. Its `cancelled` event is set, and if it is the call
+        using the connection, the connection is broken so its blocked command returns; the next run() reconnects.
+        """
+        if cancelled is not None:
+            cancelled.set()
+            if self._running is not cancelled:
+                return
+        connection = self.agent.connection
+        if connection is not None:
+            try:
+                connection.shutdown()
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        try:
+            self.agent.disconnect()
+        except Exception:
+            pass
+        self.agent.connection = None
+
+
+class ImapIdleWatcher:
+    """
+    Holds a dedicated connection in IMAP IDLE and calls on_new_mail() whenever the server
+    announces new messages. Runs on its own thread and reconnects with backoff on failure.
+    """
+
+    def __init__(self, agent: EmailFetchAgent, on_new_mail: Callable[[], None], folder: str = "inbox",
+                 idle_timeout: float = IDLE_TIMEOUT, max_backoff: float = MAX_BACKOFF):
+        self.agent = agent
+        self.on_new_mail = on_new_mail
+        self.folder = folder
+        self.idle_timeout = idle_timeout
+        self.max_backoff = max_backoff
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"imap-idle-{self.folder}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        # Unblocks a readline() that is waiting inside IDLE
+        connection = self.agent.connection
+        if connection is not None:
+            try:
+                connection.shutdown()
+            except Exception:
+                pass
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def _run(self) -> None:
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                self.agent.connect(self.folder)
+                backoff = 1
+                # Catch up on anything that arrived while we were not listening
+                self.on_new_mail()
+                while not self._stop.is_set():
+                    if self.idle_once():
+                        self.on_new_mail()
+            except _IdleTimeout:
+                continue
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"Debug: IMAP IDLE failed ({e}), retrying in {backoff}s")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                try:
+                    self.agent.disconnect()
+                except Exception:
+                    self.agent.connection = None
+
+    def idle_once(self) -> bool:
+        """
+        One IDLE cycle: returns True once the server reports new mail. imaplib has no
+        IDLE support, so the command is driven by hand.
+        """
+        connection = self.agent.connection
+        assert connection is not None, "IMAP connection not established"
+
+        tag = connection._new_tag()
+        connection.send(tag + b" IDLE\r\n")
+        line = connection.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+
+        connection.sock.settimeout(self.idle_timeout)
+        new_mail = False
+        try:
+            while not new_mail:
+                line = connection.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("connection closed during IDLE")
+                new_mail = bool(_EXISTS.match(line))
+        except socket.timeout:
+            # A timed-out socket file can't be read again, so the connection is done
+            raise _IdleTimeout()
+        finally:
+            connection.sock.settimeout(self.agent.timeout)
+
+        connection.send(b"DONE\r\n")
+        while True:
+            line = connection.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed after IDLE")
+            if line.startswith(tag):
+                return new_mail
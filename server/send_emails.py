@@ -1,27 +1,86 @@
+import queue
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+SMTP_TIMEOUT = 60
+# Logged-in connections kept open between sends
+SMTP_POOL_SIZE = 2
+
 class EmailSendAgent:
-    def __init__(self,send_add : str, mail_pass : str, smtp_server: str = "smtp.gmail.com"):
+    def __init__(self,send_add : str, mail_pass : str, smtp_server: str = "smtp.gmail.com", timeout: float = SMTP_TIMEOUT,
+                 pool_size: int = SMTP_POOL_SIZE):
         self.email_address = send_add
         self.app_password = mail_pass
         self.smtp_server = smtp_server
         self.port = 587
-        
+        self.timeout = timeout
+        self.pool_size = pool_size
+        # Most recently used first, so a burst of sends keeps reusing the freshest connection
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.smtp_server, self.port, timeout=self.timeout)
+        try:
+            server.starttls()
+            server.login(self.email_address, self.app_password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    @staticmethod
+    def _is_alive(server) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _discard(server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _acquire(self):
+        """An idle pooled connection that still answers NOOP, else a new one (STARTTLS + LOGIN)."""
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if self._is_alive(server):
+                return server
+            self._discard(server)
+
+    def _release(self, server):
+        if self._idle.qsize() < self.pool_size:
+            self._idle.put(server)
+        else:
+            self._discard(server)
+
     def send_email(self, subject : str , To : str, Body : str):
+        """Send one message over a pooled connection. Errors are raised so callers can retry."""
         message = MIMEMultipart()
         message["Subject"] = subject
         message["From"] = self.email_address
         message["To"] = To
         message.attach(MIMEText(Body,'plain'))
 
+        server = self._acquire()
         try:
-            # Connect to the SMTP server
-            with smtplib.SMTP(self.smtp_server, self.port) as server:
-                server.starttls()
-                server.login(self.email_address, self.app_password)
-                server.send_message(message)
-            print("Email sent successfully!")
-        except Exception as e:
-            print(f"Error sending email: {e}")
\ No newline at end of file
+            server.send_message(message)
+        except Exception:
+            # The session may be mid-transaction or dead; don't hand it to the next send
+            self._discard(server)
+            raise
+        self._release(server)
+        print("Email sent successfully!")
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
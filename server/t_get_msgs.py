@@ -1,21 +1,82 @@
 # t_get_msgs.py
 
+import asyncio
+import time
 from pyrogram.client import Client
+from pyrogram.errors import FloodWait
+from pyrogram.handlers import MessageHandler, EditedMessageHandler
 from collections import defaultdict
 
 SESSION_NAME = 'telegram_session'
+CHAT_LIMIT = 5
+PER_CHAT = 3
+# History requests in flight at once; the work is almost all network wait
+HISTORY_CONCURRENCY = 8
+# Live updates are handed to ingest in micro-batches: whichever comes first of
+# LISTEN_BATCH messages or LISTEN_FLUSH seconds after the first one arrived
+LISTEN_BATCH = 100
+LISTEN_FLUSH = 2.0
+# A connection idle longer than this is checked with get_me() before it is used again
+HEALTH_CHECK_INTERVAL = 60
+HEALTH_CHECK_TIMEOUT = 10
+
+def _chat_name(chat):
+    return chat.title or chat.first_name or "Unknown"
+
+def _message_dict(msg, chat_id):
+    return {"id" : msg.id,
+            "chat_id" : chat_id,
+            "text" : msg.text,
+            "date" : str(msg.date) if msg.date else ""
+            }
 
 class TelegramBotServer:
     def __init__(self, API_ID: str, API_HASH: str):
         self.app = Client(SESSION_NAME, api_id=API_ID, api_hash=API_HASH)
         self.messages_by_chat = defaultdict(list)
         # The self._is_connected flag is no longer needed.
+        # FloodWait is per account, so one chat hitting it pauses every pending request
+        self._flood_until = 0.0
+        self._updates = None
+        self._handlers = []
+        self._flusher = None
+        self._last_healthy = 0.0
+        self._connect_lock = asyncio.Lock()
+        # Sends go through one queue so a FloodWait pauses the whole outbox, not just one caller
+        self._outgoing = None
+        self._sender = None
+
+    async def _is_healthy(self):
+        try:
+            await asyncio.wait_for(self.app.get_me(), HEALTH_CHECK_TIMEOUT)
+            return True
+        except FloodWait:
+            # Rate limited, but the connection itself answered
+            return True
+        except Exception as e:
+            print(f"TelegramBotServer: Health check failed ({e}), reconnecting")
+            return False
 
     async def connect(self):
-        """Connects the client if it's not already connected."""
-        # Use the client's built-in property for a reliable check.
-        if not self.app.is_connected:
+        """
+        Connects the client if it's not already connected. A connection that has been
+        idle for a while is checked first and restarted if it no longer answers.
+        """
+        async with self._connect_lock:
+            # Use the client's built-in property for a reliable check.
+            if self.app.is_connected:
+                if time.monotonic() - self._last_healthy < HEALTH_CHECK_INTERVAL or await self._is_healthy():
+                    self._last_healthy = time.monotonic()
+                    return
+                try:
+                    await self.app.stop()
+                except Exception:
+                    pass
             await self.app.start()
+            # stop() clears the dispatcher's handler groups, so a restarted client would stop listening
+            for handler, group in self._handlers:
+                self.app.add_handler(handler, group)
+            self._last_healthy = time.monotonic()
             print("TelegramBotServer: Client connected successfully.")
 
     async def disconnect(self):
@@ -24,39 +85,195 @@ class TelegramBotServer:
             await self.app.stop()
             print("TelegramBotServer: Client disconnected.")
 
-    async def fetch_messages(self):
+    async def _wait_for_flood(self):
+        delay = self._flood_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _fetch_history(self, chat_id, per_chat, min_id, semaphore):
         """
-        Fetches the latest messages from the top 5 chats.
-        It ensures a connection is active before fetching.
+        Newest-first history of one chat down to (not including) min_id. With no watermark
+        only the latest per_chat messages are taken. Returns (messages, highest id seen).
         """
-        await self.connect()
+        async with semaphore:
+            while True:
+                await self._wait_for_flood()
+                try:
+                    messages = []
+                    last_id = min_id
+                    history_gen = self.app.get_chat_history(chat_id, limit=0 if min_id else per_chat)
+                    async for msg in history_gen: # type: ignore (This show a coroutine type error but its working tho)
+                        if msg.id <= min_id:
+                            break
+                        last_id = max(last_id, msg.id)
+                        if msg.text:
+                            messages.append(_message_dict(msg, chat_id))
+                    return list(reversed(messages)), last_id
+                except FloodWait as e:
+                    wait = int(e.value) # type: ignore
+                    print(f"TelegramBotServer: FloodWait on chat {chat_id}, pausing {wait}s")
+                    self._flood_until = max(self._flood_until, time.monotonic() + wait)
 
-        dialog_gen = self.app.get_dialogs()
-        chat_count = 0
-        
-        latest_messages = defaultdict(list)
+    async def sync_messages(self, watermarks=None, chat_limit=CHAT_LIMIT, per_chat=PER_CHAT, concurrency=HISTORY_CONCURRENCY):
+        """
+        Fetches messages newer than each chat's watermark ({chat_id: last message id}) from
+        the top chat_limit chats. Chats whose newest message is at or below the watermark
+        are skipped without a history request. Returns (messages_by_chat, {chat_id: last id}).
+        """
+        await self.connect()
+        watermarks = watermarks or {}
 
-        async for dialog in dialog_gen: # type: ignore (This show a coroutine type error but its working tho)
-            if chat_count >= 5:
+        chats = []
+        async for dialog in self.app.get_dialogs(limit=chat_limit): # type: ignore (This show a coroutine type error but its working tho)
+            if len(chats) >= chat_limit:
                 break
+            chat_name = _chat_name(dialog.chat)
+            chats.append((chat_name, dialog.chat.id, dialog.top_message))
 
-            chat_id = dialog.chat.id
-            chat_name = dialog.chat.title or dialog.chat.first_name or "Unknown"
-            chat_date =  dialog.top_message.date
-            messages = []
-            history_gen = self.app.get_chat_history(chat_id, limit=3)
-
-            async for msg in history_gen: # type: ignore (This show a coroutine type error but its working tho)
-                if msg.text:
-                    messages.append({"text" : msg.text,
-                                     "date" : str(msg.date) if msg.date else ""
-                                     })
-            
-            latest_messages[chat_name] = list(reversed(messages))
-            chat_count += 1
+        min_ids = {chat_id: watermarks.get(chat_id, 0) for _, chat_id, _ in chats}
+        changed = [
+            (chat_name, chat_id) for chat_name, chat_id, top_message in chats
+            if not (min_ids[chat_id] and top_message and top_message.id <= min_ids[chat_id])
+        ]
 
+        semaphore = asyncio.Semaphore(concurrency)
+        histories = await asyncio.gather(
+            *(self._fetch_history(chat_id, per_chat, min_ids[chat_id], semaphore) for _, chat_id in changed)
+        )
+
+        # Keeps dialog order, like the serial loop did
+        latest_messages = defaultdict(list)
+        last_ids = {}
+        for (chat_name, chat_id), (messages, last_id) in zip(changed, histories):
+            # Two chats can share a display name; rows are keyed by chat id so both are kept
+            latest_messages[chat_name].extend(messages)
+            if last_id > min_ids[chat_id]:
+                last_ids[chat_id] = last_id
+
+        print(f"TelegramBotServer: {len(changed)} of {len(chats)} chats had new messages")
+        return latest_messages, last_ids
+
+    async def fetch_messages(self, chat_limit=CHAT_LIMIT, per_chat=PER_CHAT, concurrency=HISTORY_CONCURRENCY):
+        """
+        Fetches the latest per_chat messages from the top chat_limit chats.
+        Chat histories are fetched concurrently, at most `concurrency` at a time.
+        It ensures a connection is active before fetching.
+        """
+        latest_messages, _ = await self.sync_messages(None, chat_limit, per_chat, concurrency)
         self.messages_by_chat = latest_messages
         return self.messages_by_chat
 
+    async def _on_message(self, client, msg):
+        if msg.text and msg.chat:
+            self._updates.put_nowait((_chat_name(msg.chat), _message_dict(msg, msg.chat.id), True))
+
+    async def _on_edited_message(self, client, msg):
+        # Same id as the original, so ingest replaces the stored row and its vector
+        if msg.text and msg.chat:
+            self._updates.put_nowait((_chat_name(msg.chat), _message_dict(msg, msg.chat.id), False))
+
+    async def _next_batch(self, max_batch, flush_interval):
+        loop = asyncio.get_running_loop()
+        batch = [await self._updates.get()]
+        deadline = loop.time() + flush_interval
+        while len(batch) < max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._updates.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush_updates(self, on_batch, max_batch, flush_interval):
+        while True:
+            batch = await self._next_batch(max_batch, flush_interval)
+            chats = defaultdict(list)
+            last_ids = {}
+            for chat_name, message, is_new in batch:
+                chats[chat_name].append(message)
+                # Edits carry old ids and say nothing about how far the chat has been read
+                if is_new:
+                    last_ids[message["chat_id"]] = max(last_ids.get(message["chat_id"], 0), message["id"])
+            try:
+                await on_batch(dict(chats), last_ids)
+            except Exception as e:
+                print(f"TelegramBotServer: Failed to ingest {len(batch)} live messages: {e}")
+
+    @property
+    def listening(self):
+        return bool(self._flusher and not self._flusher.done())
+
+    async def start_listening(self, on_batch, max_batch=LISTEN_BATCH, flush_interval=LISTEN_FLUSH):
+        """
+        Push new and edited text messages to on_batch(messages_by_chat, {chat_id: last new id})
+        as they arrive, instead of polling dialogs. Updates only flow while the client is connected.
+        """
+        if self.listening:
+            return
+        await self.connect()
+
+        self._updates = asyncio.Queue()
+        for handler in (MessageHandler(self._on_message), EditedMessageHandler(self._on_edited_message)):
+            self._handlers.append(self.app.add_handler(handler))
+        self._flusher = asyncio.create_task(self._flush_updates(on_batch, max_batch, flush_interval))
+        print("TelegramBotServer: Listening for new messages.")
+
+    async def stop_listening(self):
+        for handler, group in self._handlers:
+            self.app.remove_handler(handler, group)
+        self._handlers.clear()
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+
+    async def _send_one(self, to, body, future):
+        while True:
+            await self._wait_for_flood()
+            if future.done():
+                # The caller gave up during the pause; sending now would duplicate its retry
+                print(f"TelegramBotServer: Dropping message to {to}, the caller stopped waiting")
+                return None
+            await self.connect()
+            try:
+                return await self.app.send_message(to, body)
+            except FloodWait as e:
+                wait = int(e.value) # type: ignore
+                print(f"TelegramBotServer: FloodWait while sending to {to}, pausing {wait}s")
+                self._flood_until = max(self._flood_until, time.monotonic() + wait)
+
+    async def _send_loop(self):
+        while True:
+            to, body, future = await self._outgoing.get()
+            if future.done():
+                # The caller gave up before this message was sent
+                continue
+            try:
+                sent = await self._send_one(to, body, future)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(sent)
+
+    async def send_message(self, to, body):
+        """Queue a message on the shared connection and wait until it has been sent."""
+        if self._sender is None or self._sender.done():
+            self._outgoing = asyncio.Queue()
+            self._sender = asyncio.create_task(self._send_loop())
+        # Group and channel ids arrive as strings like "-1001234567890" from tool calls. Pyrogram reads a
+        # bare digit string as a phone number, so only "-" ids become ints; pass user ids as ints
+        if isinstance(to, str) and to.startswith("-") and to[1:].isdigit():
+            to = int(to)
+        future = asyncio.get_running_loop().create_future()
+        self._outgoing.put_nowait((to, body, future))
+        return await future
+
     def get_all_messages(self):
         return self.messages_by_chat
\ No newline at end of file
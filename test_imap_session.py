@@ -0,0 +1,250 @@
+import imaplib
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import CancelledError
+from server.getting_mail import EmailFetchAgent
+from server.imap_session import ImapSession, ImapIdleWatcher
+
+
+class FakeImapServer:
+    """
+    In-process stand-in for an IMAP server. Hands out FakeIMAP4 connections through
+    EmailFetchAgent's imap_factory, so sessions and IDLE run without a network or account.
+    """
+
+    def __init__(self, uids=(1, 2, 3), uidvalidity=7):
+        self.uids = list(uids)
+        self.uidvalidity = uidvalidity
+        self.connections = []
+        # Commands that drop the connection the next time they are sent, e.g. {"UID"}
+        self.fail_next = set()
+
+    def connect(self, host, timeout=None):
+        connection = FakeIMAP4(self, timeout)
+        self.connections.append(connection)
+        return connection
+
+    def deliver(self):
+        """A new message arrives; connections sitting in IDLE are told at once."""
+        self.uids.append(max(self.uids, default=0) + 1)
+        for connection in self.connections:
+            if connection.idling:
+                connection.push(f"* {len(self.uids)} EXISTS\r\n".encode())
+
+
+class _FakeSocket:
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+
+class FakeIMAP4:
+    """The part of imaplib.IMAP4 that EmailFetchAgent, ImapSession and ImapIdleWatcher use."""
+
+    def __init__(self, server, timeout):
+        self.server = server
+        self.sock = _FakeSocket(timeout)
+        self.lines = queue.Queue()
+        self.alive = True
+        self.idling = False
+        self.logged_out = False
+        self._tags = 0
+
+    def _command(self, name):
+        if not self.alive:
+            raise imaplib.IMAP4.abort("socket error: EOF")
+        if name in self.server.fail_next:
+            self.server.fail_next.discard(name)
+            self.alive = False
+            raise imaplib.IMAP4.abort("socket error: connection reset by peer")
+
+    def login(self, user, password):
+        self._command("LOGIN")
+        return "OK", [b"LOGIN completed"]
+
+    def select(self, folder):
+        self._command("SELECT")
+        return "OK", [str(len(self.server.uids)).encode()]
+
+    def response(self, code):
+        return code, [str(self.server.uidvalidity).encode()]
+
+    def noop(self):
+        self._command("NOOP")
+        return "OK", [b"NOOP completed"]
+
+    def uid(self, command, *args):
+        self._command("UID")
+        if command == "SEARCH":
+            # Only "UID n:*" and ALL; like a real server, n:* always matches the highest UID
+            low = int(args[-1].split()[1].split(":")[0]) if args[-1] != "ALL" else 1
+            found = [uid for uid in self.server.uids if uid >= low] or self.server.uids[-1:]
+            return "OK", [" ".join(map(str, found)).encode()]
+        return "OK", []
+
+    def logout(self):
+        self.logged_out = True
+        self.alive = False
+        return "BYE", []
+
+    def shutdown(self):
+        self.alive = False
+        self.push(b"")
+
+    # IDLE is driven by hand through these, as ImapIdleWatcher.idle_once does with imaplib
+
+    def _new_tag(self):
+        self._tags += 1
+        return f"A{self._tags:03d}".encode()
+
+    def push(self, line):
+        self.lines.put(line)
+
+    def send(self, data):
+        self._command("SEND")
+        if data.endswith(b" IDLE\r\n"):
+            self.idle_tag = data.split()[0]
+            self.idling = True
+            self.push(b"+ idling\r\n")
+        elif data == b"DONE\r\n":
+            self.idling = False
+            self.push(self.idle_tag + b" OK IDLE terminated\r\n")
+
+    def readline(self):
+        try:
+            return self.lines.get(timeout=self.sock.timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out")
+
+
+def make_agent(server):
+    return EmailFetchAgent("me@example.com", "secret", imap_factory=server.connect, timeout=2)
+
+
+def test_session_reuses_connection():
+    server = FakeImapServer()
+    session = ImapSession(make_agent(server))
+    for _ in range(3):
+        result = session.run(session.agent.fetch_new_emails, 3, 7)
+        assert result["emails"] == [] and result["last_uid"] == 3
+    assert len(server.connections) == 1
+
+
+def test_session_reconnects_and_retries():
+    server = FakeImapServer()
+    session = ImapSession(make_agent(server))
+    session.run(session.agent.fetch_new_emails, 3, 7)
+
+    # The server resets the connection in the middle of the next command
+    server.fail_next.add("UID")
+    result = session.run(session.agent.fetch_new_emails, 3, 7)
+    assert result["last_uid"] == 3
+    assert len(server.connections) == 2
+
+    # A connection that died between calls is replaced before the command is sent
+    server.connections[-1].alive = False
+    session.run(session.agent.fetch_new_emails, 3, 7)
+    assert len(server.connections) == 3
+
+
+def test_session_does_not_retry_aborted_call():
+    server = FakeImapServer()
+    agent = make_agent(server)
+    session = ImapSession(agent)
+    session.run(agent.fetch_new_emails, 3, 7)
+
+    cancelled, started, aborted = threading.Event(), threading.Event(), threading.Event()
+    result = {}
+
+    def slow_command():
+        started.set()
+        aborted.wait(2)
+        return agent.fetch_new_emails(3, 7)
+
+    def call():
+        try:
+            result["value"] = session.run(slow_command, cancelled=cancelled)
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    started.wait(2)
+    # What _run_imap does when its caller times out
+    session.abort(cancelled)
+    aborted.set()
+    thread.join(timeout=2)
+
+    assert isinstance(result.get("error"), imaplib.IMAP4.abort)
+    assert len(server.connections) == 1
+
+    # A call cancelled while still queued never touches the connection
+    try:
+        session.run(agent.fetch_new_emails, 3, 7, cancelled=cancelled)
+    except CancelledError:
+        pass
+    else:
+        raise AssertionError("a cancelled call should not run")
+
+
+def test_idle_once_returns_on_exists():
+    server = FakeImapServer()
+    agent = make_agent(server)
+    agent.connect()
+    watcher = ImapIdleWatcher(agent, lambda: None, idle_timeout=2)
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(new_mail=watcher.idle_once()))
+    thread.start()
+    while not agent.connection.idling:
+        time.sleep(0.01)
+    server.deliver()
+    thread.join(timeout=2)
+
+    assert result.get("new_mail") is True
+    # DONE was sent and the tagged completion consumed, so the connection is usable again
+    assert not agent.connection.idling and agent.connection.lines.empty()
+    assert agent.connection.sock.timeout == agent.timeout
+
+
+def test_watcher_reports_new_mail_and_stops():
+    server = FakeImapServer()
+    calls = queue.Queue()
+    watcher = ImapIdleWatcher(make_agent(server), lambda: calls.put(len(server.uids)), idle_timeout=0.2)
+    watcher.start()
+
+    # Catch-up on connect, then once per EXISTS
+    assert calls.get(timeout=2) == 3
+    while not any(connection.idling for connection in server.connections):
+        time.sleep(0.01)
+    server.deliver()
+    assert calls.get(timeout=2) == 4
+
+    # An IDLE that times out is restarted on a fresh connection
+    time.sleep(0.5)
+    assert len(server.connections) > 1
+
+    watcher.stop()
+    assert not watcher.running
+    assert all(connection.logged_out or not connection.alive for connection in server.connections)
+
+
+def run_tests():
+    tests = [
+        test_session_reuses_connection,
+        test_session_reconnects_and_retries,
+        test_session_does_not_retry_aborted_call,
+        test_idle_once_returns_on_exists,
+        test_watcher_reports_new_mail_and_stops,
+    ]
+    for test in tests:
+        test()
+        print(f"PASS {test.__name__}")
+
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,337 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import sqlite_vec
+from db import to_epoch, sender_key, get_sync_state, set_sync_state, BUSY_TIMEOUT
+from embed import vector_to_blob, blob_to_vector, EMBED_DIM, VECTOR_DTYPE
+from ingest import _lookup_in_chunks
+
+# "vec0" searches the vectors table directly; "faiss" answers from an HNSW index kept next to it
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "vec0")
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "vectors.faiss")
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+# A filtered FAISS search fetches this many times k, then filters on metadata
+FILTER_OVERSAMPLE = 10
+# Re-embedded rows are added again rather than replaced, so rebuild once this share of the index is incremental
+REBUILD_FRACTION = 0.2
+REBUILD_CHUNK = 10_000
+
+# Keys accepted in a semantic_search filter
+FILTER_KEYS = ("source", "sender", "since", "until")
+
+def check_filters(filters):
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filter keys {sorted(unknown)}; use {list(FILTER_KEYS)}")
+
+def vector_filters(filters):
+    """
+    Constraints on the vec0 partition key (source) and metadata columns (sender, ts), which vec0
+    applies during the KNN scan, so k results come back whenever k messages match.
+    """
+    check_filters(filters)
+    clauses, params = [], []
+    if filters.get("source"):
+        clauses.append("source = ?")
+        params.append(filters["source"])
+    if filters.get("sender"):
+        clauses.append("sender = ?")
+        params.append(sender_key(filters["sender"]))
+    if filters.get("since"):
+        clauses.append("ts >= ?")
+        params.append(to_epoch(filters["since"], strict=True))
+    if filters.get("until"):
+        clauses.append("ts < ?")
+        params.append(to_epoch(filters["until"], strict=True))
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+def filter_matcher(filters):
+    """The same filters as vector_filters, as a predicate over (source, sender, ts) from metadata."""
+    check_filters(filters)
+    source = filters.get("source")
+    sender = sender_key(filters["sender"]) if filters.get("sender") else None
+    since = to_epoch(filters["since"], strict=True) if filters.get("since") else None
+    until = to_epoch(filters["until"], strict=True) if filters.get("until") else None
+
+    def matches(row_source, row_sender, row_ts):
+        row_ts = row_ts or 0
+        return ((source is None or row_source == source)
+                and (sender is None or sender_key(row_sender) == sender)
+                and (since is None or row_ts >= since)
+                and (until is None or row_ts < until))
+    return matches
+
+
+class Vec0Store:
+    """Exact KNN straight from the vectors table; ingest already keeps it up to date."""
+
+    name = "vec0"
+
+    def search(self, db_conn, vector, k, filters=None):
+        """Return [(message id, L2 distance)] nearest first."""
+        where, params = vector_filters(filters or {})
+        cursor = db_conn.cursor()
+        cursor.execute(
+            f"SELECT id, distance FROM vectors WHERE embedding MATCH ? AND k = ?{where} ORDER BY distance",
+            (vector_to_blob(vector), k, *params)
+        )
+        return cursor.fetchall()
+
+    def add(self, db_conn, ids):
+        pass
+
+    def close(self):
+        pass
+
+
+class FaissStore:
+    """
+    Approximate KNN from a FAISS HNSW index keyed by metadata rowid. vec0 stays the source of
+    truth: the index is built from it, saved to disk, and topped up on load with rows ingested
+    since it was saved; if saved rows were changed or deleted meanwhile it is rebuilt. Re-embedded
+    rows are added again instead of replaced (HNSW can't remove), so they are rescored against
+    their current embedding, and after enough incremental adds the index is rebuilt on a
+    background thread.
+    """
+
+    name = "faiss"
+
+    def __init__(self, db_path="data.db", index_path=FAISS_INDEX_PATH, ef_search=HNSW_EF_SEARCH):
+        import faiss
+        self.faiss = faiss
+        self.db_path = db_path
+        self.index_path = index_path
+        self.ef_search = ef_search
+        self.exact = Vec0Store()
+        self._lock = threading.Lock()
+        self._rebuild_thread = None
+        # Adds that land while a rebuild is scanning, replayed onto the new index
+        self._pending = None
+        self.added = 0
+        # Highest rowid in the index; a rowid at or below it that is added again leaves a stale copy
+        self._max_rowid = 0
+        # Rowids the index also holds an older embedding for, and how many such stale copies there are
+        self._rescore = set()
+        self._stale = 0
+        # Searches use vec0 until an index built from the database is in place
+        self.built = False
+
+        if os.path.exists(index_path):
+            # Read into memory rather than with IO_FLAG_MMAP: the index is added to after loading
+            self.index = faiss.read_index(index_path)
+            self.set_ef_search(ef_search)
+            db_conn = self._connect()
+            fingerprint, saved_rowid = get_sync_state(db_conn, "faiss", self._scope())
+            self._max_rowid = saved_rowid or 0
+            self.built = True
+            self._catch_up(db_conn, saved_rowid)
+            changed = fingerprint != self._fingerprint(db_conn, saved_rowid)
+            db_conn.close()
+            if changed:
+                # The saved index serves searches meanwhile, with the old embeddings of changed rows
+                print("FaissStore: messages changed or were removed since the index was saved, rebuilding")
+                self.rebuild()
+        else:
+            self.index = self._new_index()
+            self.rebuild()
+
+    def _connect(self):
+        db_conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT)
+        db_conn.enable_load_extension(True)
+        sqlite_vec.load(db_conn)
+        return db_conn
+
+    def _new_index(self):
+        hnsw = self.faiss.IndexHNSWFlat(EMBED_DIM, HNSW_M)
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        hnsw.hnsw.efSearch = self.ef_search
+        return self.faiss.IndexIDMap(hnsw)
+
+    def set_ef_search(self, ef_search):
+        """Candidates HNSW keeps while searching: higher is better recall and slower queries."""
+        self.ef_search = ef_search
+        with self._lock:
+            self.faiss.downcast_index(self.index.index).hnsw.efSearch = ef_search
+
+    def _scope(self):
+        return os.path.abspath(self.index_path)
+
+    def _fingerprint(self, db_conn, max_rowid):
+        """
+        Digest of every message's content hash up to max_rowid. Saved with the index, so a load can
+        tell whether rows it already holds were re-embedded or deleted while the server was down.
+        """
+        digest = hashlib.sha256()
+        cursor = db_conn.execute("SELECT rowid, content_hash FROM metadata WHERE rowid <= ? ORDER BY rowid", (max_rowid,))
+        for rowid, content_hash in cursor:
+            digest.update(f"{rowid}:{content_hash}\n".encode("utf-8"))
+        # sync_state.validity is a signed 64-bit INTEGER
+        return int(digest.hexdigest()[:15], 16)
+
+    def _catch_up(self, db_conn, saved_rowid):
+        """Index rows created after the saved index was written."""
+        cursor = db_conn.execute(
+            "SELECT m.rowid, v.embedding FROM metadata m JOIN vectors v ON v.id = m.id WHERE m.rowid > ?",
+            (saved_rowid,)
+        )
+        added = 0
+        while rows := cursor.fetchmany(REBUILD_CHUNK):
+            self._add_rows(rows)
+            added += len(rows)
+        if added:
+            print(f"FaissStore: indexed {added} vectors ingested since the last save")
+
+    def _add_rows(self, rows):
+        rowids = np.array([row[0] for row in rows], dtype=np.int64)
+        vectors = np.stack([blob_to_vector(row[1]) for row in rows]).astype(VECTOR_DTYPE)
+        with self._lock:
+            self.index.add_with_ids(vectors, rowids)
+            if self._pending is not None:
+                self._pending.append((vectors, rowids))
+            self._track(rowids)
+            self.added += len(rows)
+
+    def _track(self, rowids):
+        """Note which just-added rowids duplicate one already in the index. Called holding _lock."""
+        stale = [rowid for rowid in rowids.tolist() if rowid <= self._max_rowid]
+        self._rescore.update(stale)
+        self._stale += len(stale)
+        self._max_rowid = max(self._max_rowid, int(rowids.max()))
+
+    def add(self, db_conn, ids):
+        """Index messages ingest just wrote, by message id."""
+        if not ids:
+            return
+        rowids = dict(_lookup_in_chunks(db_conn.cursor(), "SELECT id, rowid FROM metadata WHERE id IN ({placeholders})", list(ids)))
+        embeddings = _lookup_in_chunks(db_conn.cursor(), "SELECT id, embedding FROM vectors WHERE id IN ({placeholders})", list(ids))
+        rows = [(rowids[msg_id], emb) for msg_id, emb in embeddings if msg_id in rowids]
+        if rows:
+            self._add_rows(rows)
+        if self.added > REBUILD_FRACTION * max(self.index.ntotal - self.added, REBUILD_CHUNK):
+            self.rebuild()
+
+    def rebuild(self, background=True):
+        if self._rebuild_thread and self._rebuild_thread.is_alive():
+            return
+        with self._lock:
+            self._pending = []
+        if not background:
+            self._rebuild()
+            return
+        self._rebuild_thread = threading.Thread(target=self._rebuild, name="faiss-rebuild", daemon=True)
+        self._rebuild_thread.start()
+
+    def _rebuild(self):
+        try:
+            self._build()
+        except Exception as e:
+            with self._lock:
+                self._pending = None
+            print(f"FaissStore: rebuild failed ({e}), keeping the current index")
+
+    def _build(self):
+        started = time.perf_counter()
+        db_conn = self._connect()
+        index = self._new_index()
+        max_rowid = db_conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM metadata").fetchone()[0]
+        # Taken before the scan, so a row changed during it can only make the next load rebuild needlessly
+        fingerprint = self._fingerprint(db_conn, max_rowid)
+        cursor = db_conn.execute(
+            "SELECT m.rowid, v.embedding FROM vectors v JOIN metadata m ON m.id = v.id WHERE m.rowid <= ?",
+            (max_rowid,)
+        )
+        while rows := cursor.fetchmany(REBUILD_CHUNK):
+            rowids = np.array([row[0] for row in rows], dtype=np.int64)
+            index.add_with_ids(np.stack([blob_to_vector(row[1]) for row in rows]).astype(VECTOR_DTYPE), rowids)
+
+        # Write then rename, so a crash mid-write never leaves a truncated index to mmap
+        tmp_path = self.index_path + ".tmp"
+        self.faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+
+        with self._lock:
+            for vectors, rowids in self._pending:
+                index.add_with_ids(vectors, rowids)
+            self.added = sum(len(rowids) for _, rowids in self._pending)
+            self._max_rowid, self._rescore, self._stale = max_rowid, set(), 0
+            for _, rowids in self._pending:
+                self._track(rowids)
+            self._pending = None
+            self.index = index
+            self.built = True
+        # Replayed adds aren't in the saved file: new rows are past max_rowid and re-embedded ones
+        # change the fingerprint, so the next load picks both up again
+        try:
+            set_sync_state(db_conn, "faiss", self._scope(), fingerprint, max_rowid)
+        except sqlite3.OperationalError as e:
+            # Without its watermark the saved file would be read as the previous one; the next load rebuilds instead
+            print(f"FaissStore: could not record the rebuilt index ({e}), discarding the saved copy")
+            os.remove(self.index_path)
+        finally:
+            db_conn.close()
+        print(f"FaissStore: built index of {index.ntotal} vectors in {time.perf_counter() - started:.1f}s")
+
+    def search(self, db_conn, vector, k, filters=None):
+        """Return [(message id, L2 distance)] nearest first, like Vec0Store."""
+        filters = filters or {}
+        matches = filter_matcher(filters)
+        with self._lock:
+            if not self.built or self.index.ntotal == 0:
+                return self.exact.search(db_conn, vector, k, filters)
+            fetch = k * FILTER_OVERSAMPLE if filters else k
+            # Extra room for stale copies of re-embedded rows, which share a rowid
+            fetch = min(fetch + self._stale, self.index.ntotal)
+            query = np.asarray(vector, dtype=VECTOR_DTYPE).reshape(1, -1)
+            distances, rowids = self.index.search(query, fetch)
+            rescore = self._rescore & set(rowids[0].tolist())
+
+        candidates = [(int(rowid), float(dist)) for rowid, dist in zip(rowids[0], distances[0]) if rowid >= 0]
+        rows = _lookup_in_chunks(
+            db_conn.cursor(),
+            "SELECT rowid, id, source, sender, ts FROM metadata WHERE rowid IN ({placeholders})",
+            list({rowid for rowid, _ in candidates})
+        )
+        details = {row[0]: row[1:] for row in rows}
+
+        hits, seen = [], set()
+        for rowid, dist in candidates:
+            if rowid in seen or rowid not in details:
+                continue
+            seen.add(rowid)
+            msg_id, source, sender, ts = details[rowid]
+            if matches(source, sender, ts):
+                # IndexHNSWFlat reports squared L2; vec0 reports L2
+                hits.append((msg_id, dist ** 0.5, rowid in rescore))
+
+        # A re-embedded row's first hit may be its stale copy, so its distance is recomputed from the current embedding
+        stale = [msg_id for msg_id, _, rescored in hits if rescored]
+        if stale:
+            current = dict(_lookup_in_chunks(db_conn.cursor(), "SELECT id, embedding FROM vectors WHERE id IN ({placeholders})", stale))
+            hits = [
+                (msg_id, float(np.linalg.norm(query[0] - blob_to_vector(current[msg_id]))) if rescored and msg_id in current else dist, rescored)
+                for msg_id, dist, rescored in hits
+            ]
+            hits.sort(key=lambda hit: hit[1])
+
+        # A narrow filter can leave too few of the over-fetched neighbours; vec0 answers it exactly
+        if filters and len(hits) < k:
+            return self.exact.search(db_conn, vector, k, filters)
+        return [(msg_id, dist) for msg_id, dist, _ in hits[:k]]
+
+    def close(self):
+        if self._rebuild_thread:
+            self._rebuild_thread.join()
+
+
+def open_vector_store(db_path="data.db", backend=VECTOR_BACKEND):
+    if backend == "faiss":
+        return FaissStore(db_path)
+    if backend == "vec0":
+        return Vec0Store()
+    raise ValueError(f"Unknown VECTOR_BACKEND {backend!r}; use 'vec0' or 'faiss'")
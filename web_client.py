@@ -647,7 +647,9 @@ async def summarize_email_endpoint(request: SubjectRequest):
 async def get_from_addresses():
     """Parses and returns a unique list of sender email addresses."""
     if not state.froms:
-        await getting_mail()
+        # Only senders are needed here, so list headers instead of syncing full emails
+        raw_response = await call_mcp_server("list_emails")
+        state.froms = [email.get('from', '') for email in json.loads(raw_response).get('emails', [])]
 
     unique_addresses = set()
     for sender in state.froms: